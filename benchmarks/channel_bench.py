@@ -0,0 +1,70 @@
+"""Channel Lookup Benchmark
+    - Compares the old linear scan over guild.channels with ChannelIndex
+
+Usage:
+    python -m benchmarks.channel_bench --channels 500
+"""
+import argparse
+import json
+import timeit
+
+from ytdb.channel_index import ChannelIndex
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, name: str, guild):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+
+
+class FakeGuild:
+    def __init__(self, channels: int):
+        self.id = 1
+        self.voice_channels = [
+            FakeChannel(index, "Voice {index:04d}".format(index=index), self)
+            for index in range(channels)
+        ]
+        # Text channels are scanned too by the linear lookup
+        self.channels = self.voice_channels + [
+            FakeChannel(channels + index, "text-{index}".format(index=index), self)
+            for index in range(channels)
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=500)
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+
+    guild = FakeGuild(args.channels)
+    # Worst case for the scan, the last voice channel
+    name = guild.voice_channels[-1].name
+    voice_channels = set(guild.voice_channels)
+    index = ChannelIndex()
+
+    def linear():
+        return next(
+            c for c in guild.channels if c.name == name and c in voice_channels
+        )
+
+    def indexed():
+        return index.find(guild, name)
+
+    def prefix():
+        return index.find(guild, name[:-1].lower())
+
+    results = {"channels": args.channels}
+    for label, lookup in (
+        ("linear", linear),
+        ("indexed", indexed),
+        ("prefix", prefix),
+    ):
+        seconds = timeit.timeit(lookup, number=args.lookups)
+        results["{label}_us".format(label=label)] = seconds / args.lookups * 1e6
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
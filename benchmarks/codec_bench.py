@@ -0,0 +1,137 @@
+"""Codec Benchmark
+    - Plays a local Opus file through the real FFmpeg source, the way the
+      player plays a downloaded file, several streams at once
+    - Compares copying the Opus packets (acodec "opus") with encoding them
+      again with libopus, like any other codec gets
+    - Reports CPU per stream, FFmpeg's and this process's, as JSON
+
+Usage:
+    python -m benchmarks.codec_bench --streams 10 --seconds 10
+
+Generates a sine wave Opus fixture with FFmpeg unless --fixture is given.
+Every mode runs in a fresh process so each one reports its own CPU time.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+
+from benchmarks.play_bench import FRAME_SECONDS, FakeGuild
+from ytdb.queue_item import QueueItem
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+# acodec of the played item, only "opus" gets its packets copied
+MODES = {"copy": "opus", "libopus": "vorbis"}
+
+
+def make_fixture(path: str, seconds: float):
+    """Sine wave encoded to Opus in WebM, what bestaudio usually picks"""
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi"]
+        + ["-i", "sine=frequency=440:duration={s}".format(s=seconds)]
+        + ["-ac", "2", "-c:a", "libopus", "-b:a", "128k", path],
+        check=True,
+    )
+
+
+def play(source, frames: list, pace: bool):
+    """Reads the source like discord.py's AudioPlayer until it runs dry"""
+    next_frame = time.perf_counter()
+    try:
+        while source.read():
+            frames[0] += 1
+            if pace:
+                next_frame += FRAME_SECONDS
+                time.sleep(max(0, next_frame - time.perf_counter()))
+    finally:
+        source.cleanup()
+
+
+async def run(fixture: str, mode: str, streams: int, pace: bool) -> dict:
+    player = YoutubeDiscordPlayer(FakeGuild(1))
+    queue_item = QueueItem(
+        "https://www.youtube.com/watch?v=fixture",
+        0,
+        0,
+        video_id="fixture",
+        title="fixture",
+        file=fixture,
+        acodec=MODES[mode],
+    )
+    sources = [await player._create_source(queue_item) for _ in range(streams)]
+
+    frames = [[0] for _ in sources]
+    threads = [
+        threading.Thread(target=play, args=(source, counted, pace))
+        for source, counted in zip(sources, frames)
+    ]
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    # NOTE: cleanup waits for FFmpeg, so its CPU time is in by now
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    audio_seconds = sum(counted[0] for counted in frames) * FRAME_SECONDS
+    python_cpu = (after.ru_utime + after.ru_stime) - (
+        before.ru_utime + before.ru_stime
+    )
+    ffmpeg_cpu = children.ru_utime + children.ru_stime
+    return {
+        "mode": mode,
+        "streams": streams,
+        "wall_seconds": wall,
+        "audio_seconds": audio_seconds,
+        "ffmpeg_cpu_seconds": ffmpeg_cpu,
+        "python_cpu_seconds": python_cpu,
+        # CPU one stream needs per second of audio it plays
+        "cpu_ms_per_stream_second": (ffmpeg_cpu + python_cpu) / audio_seconds * 1000,
+        "ffmpeg_cpu_ms_per_stream_second": ffmpeg_cpu / audio_seconds * 1000,
+    }
+
+
+def run_process(job: tuple) -> dict:
+    return asyncio.run(run(*job))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=10)
+    parser.add_argument(
+        "--seconds", type=float, default=10.0, help="length of the generated fixture"
+    )
+    parser.add_argument("--fixture", help="local Opus file to play instead")
+    parser.add_argument(
+        "--no-pace", action="store_true", help="read as fast as FFmpeg allows"
+    )
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = args.fixture
+        if fixture is None:
+            fixture = os.path.join(directory, "fixture.webm")
+            make_fixture(fixture, args.seconds)
+
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            results = pool.map(
+                run_process,
+                [(fixture, mode, args.streams, not args.no_pace) for mode in args.modes],
+            )
+
+    print(json.dumps({"fixture": args.fixture, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
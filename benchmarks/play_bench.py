@@ -0,0 +1,424 @@
+"""Play Benchmark
+    - Drives YoutubeCommands offline, no Discord token or network needed
+    - Fakes guilds, members, voice channels/clients and stubs out yt-dlp
+    - Reports time to first audio, gap between tracks, CPU and RSS as JSON
+
+Usage:
+    python -m benchmarks.play_bench --guilds 10 --requests 5 --latency 0.2
+
+`command` is how late a `queue` command issued every 50ms finished
+compared to when it was due, i.e. handler time plus event loop lag, so
+running --guilds 1 and --guilds 50 shows what concurrent streams cost
+command handling.
+
+--processes runs that many copies side by side like the sharded deployment
+does, `streams_per_core` is how many streams kept Discord's pace per core
+worth of CPU they used.
+
+Without --fixture every track is a stream of silent Opus frames. With
+--fixture every track plays that local Opus file through the real FFmpeg
+source like a downloaded file, packets copied unless --transcode forces
+libopus, so FFmpeg's cost shows up in the CPU numbers.
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import multiprocessing
+import resource
+import threading
+import time
+
+import discord
+
+from ytdb import metrics, yt_utils
+from ytdb.yt_player import YoutubeCommands, YoutubeDiscordPlayer
+
+# discord.py sends 20ms Opus frames
+FRAME_SECONDS = 0.02
+PROBE_INTERVAL = 0.05
+SILENT_FRAME = b"\xf8\xff\xfe"
+
+
+class FakeAsset:
+    def __init__(self, url: str):
+        self.url = url
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class FakeMember:
+    def __init__(self, member_id: int, guild, channel):
+        self.id = member_id
+        self.guild = guild
+        self.display_name = "member-{id}".format(id=member_id)
+        self.display_avatar = FakeAsset("https://example.invalid/avatar.png")
+        self.voice = FakeVoiceState(channel)
+
+
+class FakeMessage:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.edits = 0
+
+    async def edit(self, **kwargs):
+        self.kwargs.update(kwargs)
+        self.edits += 1
+        return self
+
+
+class FakeMessageable:
+    """Records what was sent instead of calling the API"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, *args, **kwargs) -> FakeMessage:
+        message = FakeMessage(**kwargs)
+        self.sent.append(message)
+        return message
+
+
+class FakeVoiceClient:
+    """Reads packets on its own thread at Discord's pace like AudioPlayer"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.guild = channel.guild
+        self._connected = True
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def is_playing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        self._connected = False
+        self.guild.voice_client = None
+        if self._thread is not None:
+            # Its after callback still needs the event loop
+            await asyncio.to_thread(self._thread.join)
+
+    def play(self, source: discord.AudioSource, *, after=None):
+        # One per track like AudioPlayer, a stopped thread stays stopped
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._play, args=(source, after, self._stopped), daemon=True
+        )
+        self._thread.start()
+
+    def _play(self, source: discord.AudioSource, after, stopped: threading.Event):
+        next_frame = time.perf_counter()
+        try:
+            while not stopped.is_set():
+                if not source.read():
+                    break
+                next_frame += FRAME_SECONDS
+                time.sleep(max(0, next_frame - time.perf_counter()))
+        finally:
+            source.cleanup()
+            if after is not None:
+                after(None)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id: int, name: str, guild):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+
+    async def connect(self, **kwargs) -> FakeVoiceClient:
+        await asyncio.sleep(0.05)  # Voice handshake
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.voice_client = None
+        self.text_channel = FakeTextChannel(guild_id * 10 + 2)
+        self.channels = [FakeVoiceChannel(guild_id * 10, "General", self)]
+        self.members = [FakeMember(guild_id * 10 + 1, self, self.channels[0])]
+
+    def get_channel(self, channel_id: int):
+        return next((c for c in self.channels if c.id == channel_id), None)
+
+    def get_member(self, member_id: int):
+        return next((m for m in self.members if m.id == member_id), None)
+
+
+class FakeContext(FakeMessageable):
+    def __init__(self, guild: FakeGuild):
+        super().__init__()
+        self.guild = guild
+        self.channel = guild.text_channel
+        self.author = guild.members[0]
+
+    async def reply(self, *args, **kwargs) -> FakeMessage:
+        return await self.send(*args, **kwargs)
+
+
+class FakeResponse:
+    async def defer(self, **kwargs):
+        pass
+
+    async def send_message(self, *args, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.channel_id = guild.text_channel.id
+        self.user = guild.members[0]
+        self.response = FakeResponse()
+        self.followup = FakeMessageable()
+
+
+class SilentSource(discord.AudioSource):
+    """Silent Opus frames for track_seconds"""
+
+    def __init__(self, track_seconds: float):
+        self.frames = int(track_seconds / FRAME_SECONDS)
+
+    def read(self) -> bytes:
+        if self.frames <= 0:
+            return b""
+        self.frames -= 1
+        return SILENT_FRAME
+
+    def is_opus(self) -> bool:
+        return True
+
+
+def stub_extractor(latency: float):
+    """Replaces yt-dlp with something that only sleeps for latency"""
+
+    def _extract(url_or_string: str, should_download: bool) -> tuple:
+        with metrics.span("extract_info"):
+            time.sleep(latency)
+        video_id = url_or_string.rsplit("=", 1)[-1]
+        data = {
+            "id": video_id,
+            "title": "Track {id}".format(id=video_id),
+            "webpage_url": url_or_string,
+            "url": "bench://{id}".format(id=video_id),
+            "ext": "webm",
+            "acodec": "opus",
+            "filesize": None,
+        }
+        return data, None
+
+    yt_utils._extract = _extract
+
+
+def summarize(histogram: dict) -> dict:
+    """Mean and bucket upper bounds holding the 50th/95th percentile"""
+    if histogram is None or histogram["count"] == 0:
+        return None
+
+    count = histogram["count"]
+
+    def quantile(q):
+        for bound, cumulative in histogram["buckets"].items():
+            if cumulative >= q * count:
+                return bound
+
+    return {
+        "count": count,
+        "mean": histogram["sum"] / count,
+        "p50_le": quantile(0.5),
+        "p95_le": quantile(0.95),
+    }
+
+
+async def run_guild(cog: YoutubeCommands, guild: FakeGuild, args):
+    for index in range(args.requests):
+        url = "https://www.youtube.com/watch?v=g{guild}r{index}".format(
+            guild=guild.id, index=index
+        )
+        if args.slash:
+            await cog.qplay.callback(cog, FakeInteraction(guild), url)
+        else:
+            await cog.play.callback(cog, FakeContext(guild), url)
+        await asyncio.sleep(args.interval)
+
+    if args.skip:
+        await asyncio.sleep(args.track_seconds / 2)
+        await cog.skip.callback(cog, FakeContext(guild))
+
+    player = cog.players[guild.id]
+    while player.queue:
+        await asyncio.sleep(FRAME_SECONDS)
+    await cog.stop.callback(cog, FakeContext(guild))
+
+
+def percentiles(samples: list) -> dict:
+    """Exact percentiles of raw samples"""
+    if not samples:
+        return None
+
+    samples = sorted(samples)
+
+    def percentile(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    return {
+        "count": len(samples),
+        "p50": percentile(0.5),
+        "p99": percentile(0.99),
+        "max": samples[-1],
+    }
+
+
+async def probe_commands(cog: YoutubeCommands, guild: FakeGuild, latencies: list):
+    """Issues a queue command every PROBE_INTERVAL until cancelled"""
+    loop = asyncio.get_running_loop()
+    due = loop.time()
+    while True:
+        due += PROBE_INTERVAL
+        await asyncio.sleep(due - loop.time())
+        await cog.queue.callback(cog, FakeContext(guild))
+        latencies.append(loop.time() - due)
+
+
+async def run(args) -> dict:
+    stub_extractor(args.latency)
+    cog = YoutubeCommands(
+        None,
+        prefetch_depth=args.prefetch_depth,
+        idle_timeout=args.track_seconds,
+    )
+    if args.fixture is None:
+        # Skip FFmpeg entirely
+        async def _create_source(player, queue_item):
+            return SilentSource(args.track_seconds)
+
+        YoutubeDiscordPlayer._create_source = _create_source
+    else:
+        create_source = YoutubeDiscordPlayer._create_source
+        # Only "opus" gets its packets copied
+        acodec = "vorbis" if args.transcode else "opus"
+
+        # Played like a downloaded file, not an http stream
+        async def _create_source(player, queue_item):
+            return await create_source(
+                player,
+                dataclasses.replace(
+                    queue_item, file=args.fixture, stream_url=None, acodec=acodec
+                ),
+            )
+
+        YoutubeDiscordPlayer._create_source = _create_source
+
+    guilds = [FakeGuild(guild_id) for guild_id in range(1, args.guilds + 1)]
+    latencies = []
+    probe = asyncio.create_task(probe_commands(cog, FakeGuild(0), latencies))
+    start = time.perf_counter()
+    await asyncio.gather(*(run_guild(cog, guild, args) for guild in guilds))
+    wall = time.perf_counter() - start
+    probe.cancel()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+    snapshot = metrics.snapshot()
+    return {
+        "guilds": args.guilds,
+        "requests": args.requests,
+        "wall_seconds": wall,
+        "first_audio": summarize(snapshot["stages"].get("first_audio")),
+        "track_gap": summarize(snapshot["stages"].get("track_gap")),
+        "extract_info": summarize(snapshot["stages"].get("extract_info")),
+        "command": percentiles(latencies),
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "ffmpeg_cpu_seconds": children.ru_utime + children.ru_stime,
+        # NOTE: kilobytes on Linux
+        "max_rss_kb": usage.ru_maxrss,
+        "counters": snapshot["counters"],
+        "streams_per_core": args.guilds * wall / cpu,
+    }
+
+
+def run_process(args) -> dict:
+    """One benchmark process"""
+    yt_utils.configure(
+        audio_mode="stream",
+        metadata_ttl=args.metadata_ttl,
+        extract_workers=args.workers,
+    )
+    return asyncio.run(run(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=5, help="per guild")
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="seconds per stubbed extraction"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.0, help="seconds between requests"
+    )
+    parser.add_argument("--track-seconds", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--prefetch-depth", type=int, default=2)
+    parser.add_argument("--metadata-ttl", type=float, default=0)
+    parser.add_argument("--slash", action="store_true", help="use qplay over play")
+    parser.add_argument("--skip", action="store_true", help="skip once per guild")
+    parser.add_argument("--fixture", help="local Opus file played through FFmpeg")
+    parser.add_argument(
+        "--transcode", action="store_true", help="encode --fixture with libopus"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=1, help="each runs --guilds guilds"
+    )
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        print(json.dumps(run_process(args), indent=2))
+        return
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(args.processes) as pool:
+        results = pool.map(run_process, [args] * args.processes)
+    print(
+        json.dumps(
+            {
+                "processes": args.processes,
+                "streams": args.guilds * args.processes,
+                "streams_per_core": args.guilds
+                * args.processes
+                * max(r["wall_seconds"] for r in results)
+                / sum(r["cpu_seconds"] + r["ffmpeg_cpu_seconds"] for r in results),
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
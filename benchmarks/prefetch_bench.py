@@ -0,0 +1,108 @@
+"""Prefetch Benchmark
+    - Queues unresolved placeholders like playlists do, so every item is
+      resolved either by the prefetcher or right before it plays
+    - Reports the gap between tracks without prefetching and with it
+
+Usage:
+    python -m benchmarks.prefetch_bench --guilds 5 --tracks 4 --latency 0.3
+
+Every depth runs in a fresh process so each one reports its own metrics.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+
+from benchmarks.play_bench import FakeGuild, SilentSource, stub_extractor, summarize
+from ytdb import metrics, yt_utils
+from ytdb.prefetch import Prefetcher
+from ytdb.queue_item import QueueItem
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+
+async def run_guild(guild: FakeGuild, prefetcher: Prefetcher, args):
+    player = YoutubeDiscordPlayer(
+        guild, prefetcher=prefetcher, idle_timeout=args.track_seconds
+    )
+    channel_id = guild.channels[0].id
+    requester_id = guild.members[0].id
+    for index in range(args.tracks):
+        video_id = "g{guild}t{index}".format(guild=guild.id, index=index)
+        # What iter_playlist hands over, nothing resolved yet
+        await player.add(
+            QueueItem(
+                "https://www.youtube.com/watch?v={id}".format(id=video_id),
+                channel_id,
+                requester_id,
+                video_id=video_id,
+                title=video_id,
+            )
+        )
+    player.start()
+
+    while player.queue:
+        await asyncio.sleep(0.02)
+    await player.stop()
+
+
+async def run(args, depth: int) -> dict:
+    stub_extractor(args.latency)
+
+    # Skip FFmpeg entirely
+    async def _create_source(player, queue_item):
+        return SilentSource(args.track_seconds)
+
+    YoutubeDiscordPlayer._create_source = _create_source
+
+    prefetcher = Prefetcher(depth=depth) if depth > 0 else None
+    guilds = [FakeGuild(guild_id) for guild_id in range(1, args.guilds + 1)]
+    start = time.perf_counter()
+    await asyncio.gather(*(run_guild(guild, prefetcher, args) for guild in guilds))
+    wall = time.perf_counter() - start
+
+    snapshot = metrics.snapshot()
+    return {
+        "prefetch_depth": depth,
+        "wall_seconds": wall,
+        "track_gap": summarize(snapshot["stages"].get("track_gap")),
+        "first_audio": summarize(snapshot["stages"].get("first_audio")),
+        "extract_info": summarize(snapshot["stages"].get("extract_info")),
+    }
+
+
+def run_process(job: tuple) -> dict:
+    args, depth = job
+    yt_utils.configure(
+        audio_mode="stream", metadata_ttl=0, extract_workers=args.workers
+    )
+    return asyncio.run(run(args, depth))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--tracks", type=int, default=4, help="per guild")
+    parser.add_argument(
+        "--latency", type=float, default=0.3, help="seconds per stubbed extraction"
+    )
+    parser.add_argument("--track-seconds", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--depths", type=int, nargs="+", default=[0, 2], help="prefetch depths"
+    )
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        results = pool.map(run_process, [(args, depth) for depth in args.depths])
+    print(
+        json.dumps(
+            {"guilds": args.guilds, "tracks": args.tracks, "results": results},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
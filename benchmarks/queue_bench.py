@@ -0,0 +1,132 @@
+"""Queue Benchmark
+    - Memory per queued item, QueueItem against the dicts queues used to hold
+    - Cost of enqueueing, dequeueing and removing items of a long queue
+
+Usage:
+    python -m benchmarks.queue_bench --items 10000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+
+from benchmarks.play_bench import FakeGuild
+from ytdb.queue_item import QueueItem
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+
+def resolved_item(index: int) -> QueueItem:
+    """Queue item that plays right away"""
+    video_id = "{index:011d}".format(index=index)
+    return QueueItem(
+        "https://www.youtube.com/watch?v={id}".format(id=video_id),
+        10,
+        11,
+        video_id=video_id,
+        title="Track {index}".format(index=index),
+        stream_url="https://example.invalid/{id}.webm".format(id=video_id),
+        acodec="opus",
+    )
+
+
+def legacy_item(item: QueueItem, context) -> dict:
+    """What a queue entry looked like before QueueItem"""
+    return {
+        "download_data": {
+            "id": item.video_id,
+            "title": item.title,
+            "url": item.url,
+            "stream_url": item.stream_url,
+            "acodec": item.acodec,
+        },
+        "channel": context.channel,
+        "context": context,
+        "interaction": None,
+    }
+
+
+def bytes_per_item(items: int, build) -> float:
+    """Memory the items take on top of their (shared) strings"""
+    # Built once outside the measurement so only the containers count
+    strings = [resolved_item(index) for index in range(items)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = [build(item) for item in strings]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del built
+    return (after - before) / items
+
+
+def timed(operations: int, fn) -> float:
+    """Microseconds per operation"""
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / operations * 1e6
+
+
+async def queue_costs(items: int, removals: int) -> dict:
+    player = YoutubeDiscordPlayer(FakeGuild(1))
+    queue_items = [resolved_item(index) for index in range(items)]
+
+    start = time.perf_counter()
+    for queue_item in queue_items:
+        await player.add(queue_item)
+    enqueue_us = (time.perf_counter() - start) / items * 1e6
+
+    # Middle of the queue is the worst case for removal
+    doomed = random.Random(0).sample(queue_items[1:], removals)
+    remove_us = timed(removals, lambda: [player.remove(item) for item in doomed])
+
+    def dequeue():
+        # What play_and_pop does once a track is done
+        while player.queue:
+            item = player.queue.popleft()
+            item.queued = False
+            player.version += 1
+            player._release(item)
+
+    remaining = len(player.queue)
+    dequeue_us = timed(remaining, dequeue)
+    return {
+        "enqueue_us": enqueue_us,
+        "remove_us": remove_us,
+        "dequeue_us": dequeue_us,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--removals", type=int, default=1000)
+    args = parser.parse_args()
+
+    guild = FakeGuild(1)
+    context = type("Context", (), {"channel": guild.text_channel})()
+
+    def copy(item: QueueItem) -> QueueItem:
+        return QueueItem(
+            item.url,
+            item.channel_id,
+            item.requester_id,
+            video_id=item.video_id,
+            title=item.title,
+            stream_url=item.stream_url,
+            acodec=item.acodec,
+        )
+
+    results = {
+        "items": args.items,
+        "queue_item_bytes": bytes_per_item(args.items, copy),
+        "legacy_dict_bytes": bytes_per_item(
+            args.items, lambda item: legacy_item(item, context)
+        ),
+    }
+    results.update(asyncio.run(queue_costs(args.items, args.removals)))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""YoutubeDL Pool Benchmark
+    - Resolves one url over and over with a YoutubeDL built per call, like
+      yt_utils used to, and with the pooled instance it uses now
+    - Resolves a file served from localhost unless --url is given, so no
+      network is needed
+
+Usage:
+    python -m benchmarks.ydl_bench --resolutions 100
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+
+import yt_dlp as youtube_dl
+
+from ytdb.ydl_pool import YoutubeDLPool
+from ytdb.yt_utils import _outtmpl, _ydl_opts
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def timed(resolutions: int, resolve) -> dict:
+    """Runs resolve resolutions times, milliseconds per call"""
+    samples = []
+    for _ in range(resolutions):
+        start = time.perf_counter()
+        resolve()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    return {
+        "total_seconds": sum(samples) / 1000,
+        "mean_ms": sum(samples) / len(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p99_ms": samples[min(len(samples) - 1, int(0.99 * len(samples)))],
+    }
+
+
+def run(url: str, resolutions: int) -> dict:
+    ydl_opts = _ydl_opts(_outtmpl(False))
+    # Closing an instance saves its cookie jar over the cookie file, an
+    # empty one would keep bot.py from ever writing cookies_data
+    del ydl_opts["cookiefile"]
+
+    def per_call():
+        with youtube_dl.YoutubeDL(dict(ydl_opts)) as ytdl:
+            ytdl.extract_info(url, download=False)
+
+    pool = YoutubeDLPool()
+
+    def pooled():
+        pool.get(ydl_opts).extract_info(url, download=False)
+
+    # Extractors get imported lazily on first use, keep that out of both
+    per_call()
+
+    results = {"url": url, "resolutions": resolutions}
+    results["per_call"] = timed(resolutions, per_call)
+    results["pooled"] = timed(resolutions, pooled)
+    results["pooled"]["instances_created"] = pool.created
+    results["speedup"] = (
+        results["per_call"]["total_seconds"] / results["pooled"]["total_seconds"]
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", type=int, default=100)
+    parser.add_argument("--url", help="resolve this instead of a local file")
+    args = parser.parse_args()
+
+    if args.url is not None:
+        print(json.dumps(run(args.url, args.resolutions), indent=2))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "track.webm"), "wb") as f:
+            f.write(os.urandom(64 << 10))
+
+        server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory)
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = "http://{host}:{port}/track.webm".format(
+                host=server.server_address[0], port=server.server_address[1]
+            )
+            print(json.dumps(run(url, args.resolutions), indent=2))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,210 @@
 """
 import os
 
-import asyncio
 import json
+import multiprocessing
+import time
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
+from ytdb import yt_utils
 from ytdb.yt_player import YoutubeCommands
 
+# Discord allows one shard to identify every 5 seconds
+IDENTIFY_INTERVAL = 5.0
+
+# Workers that die sooner than this after starting get restarted with a delay
+RESTART_BACKOFF = 30.0
+
+
+def configure():
+    """Configures audio fetching from the env"""
+    audio_mode = os.getenv("AUDIO_MODE", "stream")
+    print("audio_mode: {audio_mode}".format(audio_mode=audio_mode))
+
+    tmp_dir = os.getenv("AUDIO_TMP_DIR", "audio_tmp")
+    cache_dir = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+    cache_max_bytes = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(1 << 30)))
+    print(
+        "audio_cache: {cache_dir} ({cache_max_bytes} bytes)".format(
+            cache_dir=cache_dir, cache_max_bytes=cache_max_bytes
+        )
+    )
+    metadata_ttl = float(os.getenv("METADATA_CACHE_TTL", "3600"))
+    metadata_db = os.getenv("METADATA_CACHE_DB")
+    print(
+        "metadata_cache: {metadata_ttl}s ({metadata_db})".format(
+            metadata_ttl=metadata_ttl, metadata_db=metadata_db or "memory"
+        )
+    )
+    extract_workers = int(os.getenv("EXTRACT_WORKERS", "4"))
+    print("extract_workers: {extract_workers}".format(extract_workers=extract_workers))
+    clip_max_bytes = int(os.getenv("CLIP_MAX_BYTES", "0"))
+    clip_memory_bytes = int(os.getenv("CLIP_MEMORY_BYTES", str(64 << 20)))
+    print(
+        "clip_memory: {clip_max_bytes} bytes per clip, {clip_memory_bytes} total".format(
+            clip_max_bytes=clip_max_bytes, clip_memory_bytes=clip_memory_bytes
+        )
+    )
+    loudness_target = os.getenv("LOUDNESS_TARGET")
+    loudness_target = float(loudness_target) if loudness_target else None
+    print("loudness_target: {loudness_target}".format(loudness_target=loudness_target))
+    yt_utils.configure(
+        audio_mode=audio_mode,
+        cache_dir=cache_dir,
+        cache_max_bytes=cache_max_bytes,
+        metadata_ttl=metadata_ttl,
+        metadata_db=metadata_db,
+        extract_workers=extract_workers,
+        tmp_dir=tmp_dir,
+        clip_max_bytes=clip_max_bytes,
+        clip_memory_bytes=clip_memory_bytes,
+        loudness_target=loudness_target,
+    )
+    yt_utils.warm_up()
+
+
+def create_bot(shard_ids: list = None, shard_count: int = None) -> commands.Bot:
+    """Creates the bot, its cog gets loaded once it starts
+
+    Args:
+        shard_ids (list, optional): Shards this process runs. Defaults to None
+            (all of them).
+        shard_count (int, optional): Total shards, 0 lets Discord pick.
+            Defaults to None (not sharded).
+
+    Returns:
+        commands.Bot: The bot
+    """
+    command_prefix = json.loads(os.getenv("COMMAND_PREFIX", '["!steve "]'))
+
+    # Create Intents for bot
+    print("Creating intents...")
+    intents = discord.Intents.default()
+    intents.message_content = True
+
+    # Create bot
+    print("Creating main bot...")
+    if shard_count is None:
+        main_bot = commands.Bot(
+            command_prefix=command_prefix,
+            intents=intents,
+            activity=discord.Game("some music!"),
+        )
+    else:
+        main_bot = commands.AutoShardedBot(
+            command_prefix=command_prefix,
+            intents=intents,
+            activity=discord.Game("some music!"),
+            shard_ids=shard_ids,
+            shard_count=shard_count or None,
+        )
+
+    @main_bot.event
+    async def setup_hook():
+        """Loads the cog on the loop the bot runs on, so whatever it starts
+        (e.g. the metrics server) keeps running
+        """
+        await main_bot.load_extension("ytdb.yt_player")
+
+    @main_bot.event
+    async def on_ready():
+        """On Ready for bot"""
+        print(f"{main_bot.user} has connected to Discord!")
+
+    return main_bot
+
+
+def run_bot(shard_ids: list = None, shard_count: int = None):
+    """Configures and runs the bot until it gets closed
+
+    Args:
+        shard_ids (list, optional): Shards this process runs. Defaults to None
+            (all of them).
+        shard_count (int, optional): Total shards, 0 lets Discord pick.
+            Defaults to None (not sharded).
+    """
+    token = os.getenv("DISCORD_TOKEN")
+    configure()
+    create_bot(shard_ids=shard_ids, shard_count=shard_count).run(token)
+
+
+def run_worker(index: int, shard_ids: list, shard_count: int):
+    """Entry point of one shard worker process
+
+    Args:
+        index (int): Worker number
+        shard_ids (list): Shards the worker runs
+        shard_count (int): Total shards across all workers
+    """
+    load_dotenv()
+    print(
+        "worker {index}: shards {shard_ids} of {shard_count}".format(
+            index=index, shard_ids=shard_ids, shard_count=shard_count
+        )
+    )
+
+    # One metrics port per worker
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    if metrics_port:
+        os.environ["METRICS_PORT"] = str(metrics_port + index)
+
+    run_bot(shard_ids=shard_ids, shard_count=shard_count)
+
+
+def supervise(shard_count: int, processes: int):
+    """Spreads shards over worker processes and restarts any that die
+
+    Every worker shares the audio cache directory.
+
+    Args:
+        shard_count (int): Total shards
+        processes (int): How many worker processes to run them in
+    """
+    context = multiprocessing.get_context("spawn")
+    shard_groups = [
+        list(range(index, shard_count, processes)) for index in range(processes)
+    ]
+    workers = {}  # index -> (process, when it started)
+
+    def start(index: int):
+        process = context.Process(
+            target=run_worker,
+            args=(index, shard_groups[index], shard_count),
+            name="shard-worker-{index}".format(index=index),
+        )
+        process.start()
+        workers[index] = (process, time.monotonic())
+
+    try:
+        for index in range(processes):
+            start(index)
+            # Don't let workers identify at the same time
+            time.sleep(IDENTIFY_INTERVAL * len(shard_groups[index]))
+
+        while True:
+            time.sleep(1)
+            for index, (process, started) in list(workers.items()):
+                if process.is_alive():
+                    continue
+
+                print(
+                    "worker {index} exited with {code}, restarting".format(
+                        index=index, code=process.exitcode
+                    )
+                )
+                if time.monotonic() - started < RESTART_BACKOFF:
+                    # Crash looping, don't hammer the gateway
+                    time.sleep(RESTART_BACKOFF)
+                start(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process, _ in workers.values():
+            process.terminate()
+        for process, _ in workers.values():
+            process.join()
+
 
 def main():
     """Main"""
@@ -17,7 +214,6 @@ def main():
     # Get envs
     print("Loading dotenv")
     load_dotenv()
-    token = os.getenv("DISCORD_TOKEN")
 
     env = os.getenv("ENV", "dev")
     print("environment: {env}".format(env=env))
@@ -25,11 +221,17 @@ def main():
     command_prefix = json.loads(os.getenv("COMMAND_PREFIX", '["!steve "]'))
     print("command_prefix(es): {command_prefix}".format(command_prefix=command_prefix))
 
-    # Create Intents for bot
-    print("Creating intents...")
-    intents = discord.Intents.default()
-    intents.message_content = True
-    
+    # Unset runs a plain Bot, 0 lets Discord pick the shard count
+    shard_count = os.getenv("SHARD_COUNT")
+    shard_count = int(shard_count) if shard_count else None
+    shard_processes = int(os.getenv("SHARD_PROCESSES", "1"))
+    print(
+        "shards: {shard_count} in {shard_processes} process(es)".format(
+            shard_count="off" if shard_count is None else shard_count or "auto",
+            shard_processes=shard_processes,
+        )
+    )
+
     # Create cookies file if it doesn't exist
     if not os.path.exists("cookies.txt"):
         if os.getenv("cookies_data") is None:
@@ -38,23 +240,14 @@ def main():
             print("Creating cookies.txt file...")
             with open("cookies.txt", "w") as f:
                 f.write(os.getenv("cookies_data"))
-        
 
-    # Create bot
-    print("Creating main bot...")
-    main_bot = commands.Bot(
-        command_prefix=command_prefix,
-        intents=intents,
-        activity=discord.Game("some music!"),
-    )
-
-    @main_bot.event
-    async def on_ready():
-        """On Ready for bot"""
-        print(f"{main_bot.user} has connected to Discord!")
+    if shard_processes > 1:
+        if not shard_count:
+            raise ValueError("SHARD_COUNT has to be set to run several processes")
+        supervise(shard_count, min(shard_processes, shard_count))
+        return
 
-    asyncio.run(main_bot.load_extension("ytdb.yt_player"))
-    main_bot.run(token)
+    run_bot(shard_count=shard_count)
 
 
 if __name__ == "__main__":
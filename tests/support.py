@@ -0,0 +1,326 @@
+"""Test Support
+    - Runs yt_utils offline against a stubbed yt-dlp in a temporary directory
+    - Serves local files over HTTP, byte ranges included, like a stream url
+    - Fake guilds, channels and voice clients come from benchmarks.play_bench
+
+"""
+import asyncio
+import functools
+import http.server
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from collections import Counter
+from unittest import mock
+
+import discord
+
+from ytdb import yt_utils
+from ytdb.queue_item import QueueItem
+
+# Module state of yt_utils every test gets back untouched
+_GLOBALS = (
+    "_audio_mode",
+    "_audio_cache",
+    "_tmp_dir",
+    "_downloads",
+    "_clip_store",
+    "_loudness",
+    "_metadata_cache",
+    "_scheduler",
+)
+
+FFMPEG = shutil.which("ffmpeg")
+
+
+def video_url(index: int) -> str:
+    """Youtube url whose video id yt_utils can read off without yt-dlp"""
+    return "https://www.youtube.com/watch?v={index:011d}".format(index=index)
+
+
+def resolved_item(index: int, channel_id: int) -> QueueItem:
+    """Queue item that plays right away, nothing left to resolve"""
+    return QueueItem(
+        video_url(index),
+        channel_id,
+        0,
+        video_id="{index:011d}".format(index=index),
+        title="Track {index}".format(index=index),
+        stream_url="bench://{index}".format(index=index),
+        acodec="opus",
+    )
+
+
+async def wait_until(predicate, timeout: float = 5.0):
+    """Polls predicate on the event loop until it holds
+
+    Raises:
+        asyncio.TimeoutError: It didn't hold within timeout seconds
+    """
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.005)
+
+
+async def stop_player(player):
+    """Stops player and waits until its last track wound down, so nothing
+    runs once the test's loop is closed and yt_utils is restored
+    """
+    await player.stop()
+    await wait_until(lambda: player.current is None)
+
+
+class StubExtractor:
+    """Stands in for yt_utils._extract without ever asking Youtube
+
+    Counts calls per (video id, should_download or "process"), can block on
+    `gate`, sleep for `latency` and fail the next `failures[video id]` calls.
+    Downloads write `size` bytes to the staging path the real extraction
+    would use.
+    """
+
+    def __init__(self, stream_url=None, latency: float = 0.0, size: int = 1024):
+        self.stream_url = stream_url or "bench://{id}".format
+        self.latency = latency
+        self.size = size
+        self.failures = Counter()  # video id -> calls still to fail
+        # Cleared to hold every extraction until set again
+        self.gate = threading.Event()
+        self.gate.set()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    def __call__(self, url_or_string: str, should_download: bool) -> tuple:
+        video_id = yt_utils.parse_video_id(url_or_string) or url_or_string
+        with self._lock:
+            self.calls[(video_id, should_download)] += 1
+            failing = self.failures[video_id] > 0
+            self.failures[video_id] -= failing
+
+        self.gate.wait()
+        time.sleep(self.latency)
+        if failing:
+            raise RuntimeError("stub extraction of {id} failed".format(id=video_id))
+
+        data = {
+            "id": video_id,
+            "title": "Track {id}".format(id=video_id),
+            "webpage_url": url_or_string,
+            "url": self.stream_url(id=video_id),
+            "ext": "webm",
+            "acodec": "opus",
+            "filesize": self.size,
+        }
+        if not should_download:
+            return data, None
+        return data, self._write(video_id)
+
+    def process(self, info: dict) -> tuple:
+        """Stands in for yt_utils._process, downloading what was resolved"""
+        with self._lock:
+            self.calls[(info["id"], "process")] += 1
+        return info, self._write(info["id"])
+
+    def _write(self, video_id: str) -> str:
+        filename = yt_utils._outtmpl(True) % {"id": video_id, "ext": "webm"}
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(b"\0" * self.size)
+        return filename
+
+
+class OfflineTestCase(unittest.IsolatedAsyncioTestCase):
+    """yt_utils configured into a fresh temporary directory, yt-dlp stubbed
+
+    Subclasses pick the configuration through the class attributes.
+    """
+
+    audio_mode = "stream"
+    cache_max_bytes = 0
+    metadata_ttl = 3600
+    extract_workers = 4
+    clip_max_bytes = 0
+
+    def setUp(self):
+        saved = {name: getattr(yt_utils, name) for name in _GLOBALS}
+        self.addCleanup(self._restore, saved)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.tmp_dir = os.path.join(self.directory, "audio_tmp")
+        self.cache_dir = os.path.join(self.directory, "audio_cache")
+
+        yt_utils._downloads = {}
+        yt_utils.configure(
+            audio_mode=self.audio_mode,
+            cache_dir=self.cache_dir,
+            cache_max_bytes=self.cache_max_bytes,
+            metadata_ttl=self.metadata_ttl,
+            extract_workers=self.extract_workers,
+            tmp_dir=self.tmp_dir,
+            clip_max_bytes=self.clip_max_bytes,
+        )
+
+        self.extractor = StubExtractor()
+        for name, stub in (
+            ("_extract", self.extractor),
+            ("_process", self.extractor.process),
+        ):
+            patcher = mock.patch.object(yt_utils, name, stub)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Nothing may stay blocked once the test is over
+        self.addCleanup(self.extractor.gate.set)
+
+    @staticmethod
+    def _restore(saved: dict):
+        yt_utils._scheduler._executor.shutdown(wait=False, cancel_futures=True)
+        if yt_utils._audio_cache is not None:
+            yt_utils._audio_cache.close()
+        for name, value in saved.items():
+            setattr(yt_utils, name, value)
+
+    def written_files(self) -> list:
+        """Every file below the temporary directory, relative to it"""
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.directory)
+            for root, _, names in os.walk(self.directory)
+            for name in names
+        )
+
+
+class _RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files the way FFmpeg's http input reads them, byte ranges
+    included so it can seek
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def end_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        self.server.requests.append((self.path, range_header))
+        if range_header is None:
+            return super().send_head()
+
+        path = self.translate_path(self.path)
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            self.send_error(404)
+            return None
+
+        first, _, last = range_header.removeprefix("bytes=").partition("-")
+        first = int(first)
+        last = min(int(last), len(body) - 1) if last else len(body) - 1
+        if first >= len(body):
+            self.send_error(416)
+            return None
+
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header(
+            "Content-Range",
+            "bytes {first}-{last}/{size}".format(first=first, last=last, size=len(body)),
+        )
+        self.send_header("Content-Length", str(last - first + 1))
+        self.end_headers()
+        return io.BytesIO(body[first : last + 1])
+
+
+class FileServer:
+    """Serves a directory on localhost on its own thread
+
+    `requests` holds (path, Range header) of every request served.
+    """
+
+    def __init__(self, directory: str):
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(_RangeHandler, directory=directory)
+        )
+        self._server.requests = []
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def requests(self) -> list:
+        return self._server.requests
+
+    def url(self, name: str) -> str:
+        host, port = self._server.server_address
+        return "http://{host}:{port}/{name}".format(host=host, port=port, name=name)
+
+    def __enter__(self) -> "FileServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class RecordingFFmpeg(discord.AudioSource):
+    """Takes FFmpegOpusAudio's place where there is no FFmpeg
+
+    Records what it was built with and reads urls over HTTP itself, handing
+    out the bytes as packets, so a track still ends once its input does.
+    """
+
+    PACKET_BYTES = 640
+    # How long fake stream urls play
+    FAKE_PACKETS = 5
+
+    created = []
+
+    def __init__(self, source, **kwargs):
+        self.source = source
+        self.kwargs = kwargs
+        self.bytes_read = 0
+        self._input = None
+        RecordingFFmpeg.created.append(self)
+
+    @classmethod
+    async def from_probe(cls, source, **kwargs):
+        return cls(source, **kwargs)
+
+    def read(self) -> bytes:
+        if self._input is None:
+            if self.kwargs.get("pipe"):
+                self._input = self.source
+            elif self.source.startswith("http"):
+                self._input = urllib.request.urlopen(self.source)
+            else:
+                # Fake stream urls play as silence
+                silence = b"\0" * self.PACKET_BYTES * self.FAKE_PACKETS
+                self._input = io.BytesIO(silence)
+
+        packet = self._input.read(self.PACKET_BYTES)
+        self.bytes_read += len(packet)
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        if self._input is not None:
+            self._input.close()
+
+    @classmethod
+    def patch(cls) -> mock._patch:
+        """Patcher swapping it in for discord.FFmpegOpusAudio"""
+        cls.created = []
+        return mock.patch.object(discord, "FFmpegOpusAudio", cls)
@@ -0,0 +1,76 @@
+"""Eviction from a cache directory several processes share"""
+import os
+import tempfile
+import unittest
+
+from ytdb.audio_cache import AudioCache
+
+FILE_BYTES = 1024
+
+
+class SharedDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        # Each cache stands in for one process sharing the directory
+        self.first = self.open_cache()
+        self.second = self.open_cache()
+
+    def open_cache(self) -> AudioCache:
+        cache = AudioCache(self.directory, max_bytes=3 * FILE_BYTES - 1)
+        self.addCleanup(cache.close)
+        return cache
+
+    def put(self, cache: AudioCache, video_id: str) -> dict:
+        tmp_file = os.path.join(cache.tmp_directory, video_id + ".webm")
+        with open(tmp_file, "wb") as f:
+            f.write(os.urandom(FILE_BYTES))
+        return cache.put(tmp_file, {"id": video_id})
+
+    def test_files_pinned_by_another_process_are_kept(self):
+        playing = self.put(self.first, "a")
+        # Known to the second cache, but not in use there
+        self.second.get("a")
+        self.second.unpin("a")
+
+        finished = self.put(self.second, "b")
+        self.second.unpin("b")
+        self.put(self.second, "c")
+
+        self.assertTrue(os.path.exists(playing["file"]))
+        self.assertFalse(os.path.exists(finished["file"]))
+
+    def test_unpinned_files_are_evicted_again(self):
+        playing = self.put(self.first, "a")
+        self.second.get("a")
+        self.second.unpin("a")
+        self.first.unpin("a")
+
+        self.put(self.second, "b")
+        self.put(self.second, "c")
+
+        self.assertFalse(os.path.exists(playing["file"]))
+
+    def test_budget_covers_every_process(self):
+        for cache, video_ids in ((self.first, "ab"), (self.second, "cd")):
+            for video_id in video_ids:
+                self.put(cache, video_id)
+                cache.unpin(video_id)
+
+        cached = [name for name in os.listdir(self.directory) if name.endswith(".webm")]
+        self.assertEqual(sorted(cached), ["c.webm", "d.webm"])
+
+    def test_pins_of_a_dead_process_are_dropped(self):
+        playing = self.put(self.first, "a")
+        self.second.get("a")
+        self.second.unpin("a")
+        # Dies holding its pin, the kernel releases its lock
+        self.first._owner_lock.close()
+
+        self.put(self.second, "b")
+        self.put(self.second, "c")
+
+        self.assertFalse(os.path.exists(playing["file"]))
+        owner = os.path.basename(self.second._own_pins)
+        self.assertEqual(
+            sorted(os.listdir(self.second.pin_directory)), [owner, owner + ".lock"]
+        )
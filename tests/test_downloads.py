@@ -0,0 +1,172 @@
+"""Concurrent resolutions and downloads against the stubbed yt-dlp"""
+import asyncio
+import os
+
+from ytdb import yt_utils
+from ytdb.extract_scheduler import ExtractCancelled
+
+from .support import OfflineTestCase, video_url, wait_until
+
+GUILDS = 20
+REQUESTS = 5
+
+
+class SharedDownloadTest(OfflineTestCase):
+    audio_mode = "download"
+    cache_max_bytes = 1 << 20
+
+    def setUp(self):
+        super().setUp()
+        self.extractor.latency = 0.05
+
+    async def test_every_guild_shares_one_download(self):
+        results = await asyncio.gather(
+            *(
+                yt_utils.download(video_url(1), str(guild))
+                for guild in range(GUILDS)
+                for _ in range(REQUESTS)
+            )
+        )
+
+        self.assertEqual(self.extractor.calls, {("00000000001", True): 1})
+        self.assertEqual(
+            {download_data["file"] for download_data in results},
+            {os.path.join(self.cache_dir, "00000000001.webm")},
+        )
+        # Every request holds its own pin on the shared file
+        cache = yt_utils.get_audio_cache()
+        self.assertEqual(cache._pins["00000000001"], GUILDS * REQUESTS)
+
+    async def test_distinct_videos_download_once_each(self):
+        await asyncio.gather(
+            *(
+                yt_utils.download(video_url(video), str(guild))
+                for guild in range(GUILDS)
+                for video in range(REQUESTS)
+            )
+        )
+
+        self.assertEqual(self.extractor.total, REQUESTS)
+        self.assertEqual(set(self.extractor.calls.values()), {1})
+
+    async def test_metadata_is_resolved_once_across_guilds(self):
+        await asyncio.gather(
+            *(yt_utils.resolve(video_url(1), str(guild)) for guild in range(GUILDS))
+        )
+
+        self.assertEqual(self.extractor.calls, {("00000000001", False): 1})
+
+
+class PerGuildDownloadTest(OfflineTestCase):
+    audio_mode = "download"
+
+    async def test_guilds_download_to_their_own_paths(self):
+        results = await asyncio.gather(
+            *(
+                yt_utils.download(video_url(1), str(guild))
+                for guild in range(GUILDS)
+                for _ in range(REQUESTS)
+            )
+        )
+
+        # Shared within a guild only
+        self.assertEqual(self.extractor.total, GUILDS)
+        self.assertEqual(
+            {download_data["file"] for download_data in results},
+            {
+                os.path.join(self.tmp_dir, str(guild), "00000000001.webm")
+                for guild in range(GUILDS)
+            },
+        )
+        for download_data in results:
+            self.assertTrue(os.path.exists(download_data["file"]))
+
+
+class StoppedLeaderTest(OfflineTestCase):
+    """Another guild's stop only cancels that guild's requests"""
+
+    audio_mode = "download"
+    cache_max_bytes = 1 << 20
+    # One worker, parked, keeps the leader's job waiting to be cancelled
+    extract_workers = 1
+
+    async def asyncSetUp(self):
+        self.extractor.gate.clear()
+        self.parked = asyncio.ensure_future(yt_utils.resolve(video_url(999), "park"))
+        await wait_until(lambda: self.extractor.total == 1)
+
+    async def start(self, request, *tags) -> list:
+        """Starts request for every tag, the first one leading"""
+        scheduler = yt_utils.get_scheduler()
+        tasks = [asyncio.ensure_future(request(video_url(1), tags[0]))]
+        await wait_until(lambda: scheduler.stats()["queue_depth"] == 1)
+        for tag in tags[1:]:
+            tasks.append(asyncio.ensure_future(request(video_url(1), tag)))
+        # Followers are waiting on the leader
+        await asyncio.sleep(0.01)
+        self.assertEqual(scheduler.stats()["queue_depth"], 1)
+        return tasks
+
+    async def finish(self, tasks: list) -> list:
+        self.extractor.gate.set()
+        await self.parked
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def test_follower_resolves_itself_when_leader_is_stopped(self):
+        tasks = await self.start(yt_utils.resolve, "A", "B")
+        yt_utils.get_scheduler().cancel("A")
+        leader, follower = await self.finish(tasks)
+
+        self.assertIsInstance(leader, ExtractCancelled)
+        self.assertEqual(follower["id"], "00000000001")
+        self.assertEqual(self.extractor.calls[("00000000001", False)], 1)
+
+    async def test_follower_downloads_itself_when_leader_is_stopped(self):
+        tasks = await self.start(yt_utils.download, "A", "B", "C")
+        yt_utils.get_scheduler().cancel("A")
+        leader, *followers = await self.finish(tasks)
+
+        self.assertIsInstance(leader, ExtractCancelled)
+        for download_data in followers:
+            self.assertTrue(download_data["cached"])
+            self.assertTrue(os.path.exists(download_data["file"]))
+        self.assertEqual(self.extractor.calls[("00000000001", True)], 1)
+
+    async def test_stop_cancels_the_stopped_guilds_followers(self):
+        tasks = await self.start(yt_utils.download, "A", "A", "B")
+        yt_utils.get_scheduler().cancel("A")
+        leader, same_guild, other_guild = await self.finish(tasks)
+
+        self.assertIsInstance(leader, ExtractCancelled)
+        self.assertIsInstance(same_guild, ExtractCancelled)
+        self.assertTrue(other_guild["cached"])
+
+
+class ClipFallbackTest(OfflineTestCase):
+    """Downloads too big to keep in memory go to disk without a second
+    extraction
+    """
+
+    audio_mode = "download"
+    cache_max_bytes = 1 << 20
+    clip_max_bytes = 512
+
+    async def test_resolved_info_is_downloaded(self):
+        download_data = await yt_utils.download(video_url(1), "1")
+
+        self.assertNotIn("clip", download_data)
+        self.assertTrue(os.path.exists(download_data["file"]))
+        self.assertEqual(
+            self.extractor.calls,
+            {("00000000001", False): 1, ("00000000001", "process"): 1},
+        )
+
+    async def test_cached_metadata_leaves_one_extraction(self):
+        await yt_utils.resolve(video_url(1), "1")
+        download_data = await yt_utils.download(video_url(1), "1")
+
+        self.assertTrue(os.path.exists(download_data["file"]))
+        self.assertEqual(
+            self.extractor.calls,
+            {("00000000001", False): 1, ("00000000001", True): 1},
+        )
@@ -0,0 +1,60 @@
+"""Cached tracks get measured once in the background"""
+import asyncio
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from ytdb.audio_cache import AudioCache
+from ytdb.loudness import LoudnessAnalyzer
+
+from .support import FFMPEG, wait_until
+
+
+class LoudnessAnalyzerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.cache = AudioCache(directory)
+        self.addCleanup(self.cache.close)
+        self.analyzer = LoudnessAnalyzer(self.cache)
+
+    def put(self, video_id: str, write) -> dict:
+        tmp_file = os.path.join(self.cache.tmp_directory, video_id + ".webm")
+        write(tmp_file)
+        return self.cache.put(tmp_file, {"id": video_id})
+
+    async def test_analysis_is_held_until_annotated(self):
+        measuring = asyncio.Event()
+
+        async def measure(file):
+            await measuring.wait()
+            return {"input_i": "-20.0", "input_tp": "-10.0"}
+
+        self.enterContext(mock.patch.object(self.analyzer, "_measure", measure))
+        download_data = self.put("a", lambda path: open(path, "wb").close())
+
+        self.analyzer.schedule(download_data)
+        self.assertIsInstance(self.analyzer._pending["a"], asyncio.Task)
+
+        measuring.set()
+        await wait_until(lambda: not self.analyzer._pending)
+        self.assertEqual(self.cache.get("a")["gain_db"], 4.0)
+
+    @unittest.skipUnless(FFMPEG, "needs ffmpeg")
+    async def test_quiet_track_gets_turned_up(self):
+        download_data = self.put(
+            "quiet",
+            lambda path: subprocess.run(
+                [FFMPEG, "-loglevel", "error", "-f", "lavfi"]
+                + ["-i", "sine=duration=3", "-af", "volume=-30dB"]
+                + ["-c:a", "libopus", path],
+                check=True,
+            ),
+        )
+
+        self.analyzer.schedule(download_data)
+        await wait_until(lambda: not self.analyzer._pending, timeout=30)
+
+        self.assertEqual(self.analyzer.failed, 0)
+        self.assertGreater(self.cache.get("quiet")["gain_db"], 0)
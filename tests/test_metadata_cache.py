@@ -0,0 +1,34 @@
+"""Metadata cache expiry"""
+import unittest
+from unittest import mock
+
+from ytdb import metadata_cache
+from ytdb.metadata_cache import SWEEP_INTERVAL, MetadataCache
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(metadata_cache.time, "time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_expired_entries_are_swept_without_being_looked_up(self):
+        cache = MetadataCache(ttl=10)
+        for index in range(100):
+            cache.set("search:{index}".format(index=index), {"id": str(index)})
+
+        self.now += SWEEP_INTERVAL
+        cache.set("search:fresh", {"id": "fresh"})
+
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertEqual(cache.get("search:fresh"), {"id": "fresh"})
+
+    def test_unexpired_entries_survive_a_sweep(self):
+        cache = MetadataCache(ttl=SWEEP_INTERVAL * 2)
+        cache.set("search:old", {"id": "old"})
+
+        self.now += SWEEP_INTERVAL
+        cache.set("search:new", {"id": "new"})
+
+        self.assertEqual(cache.stats()["entries"], 2)
@@ -0,0 +1,34 @@
+"""Metrics endpoint"""
+import contextlib
+import io
+import os
+import socket
+import unittest
+from unittest import mock
+
+import aiohttp
+
+import bot
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MetricsServerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_bot_serves_metrics_from_its_own_loop(self):
+        port = free_port()
+        with mock.patch.dict(os.environ, {"METRICS_PORT": str(port)}):
+            with contextlib.redirect_stdout(io.StringIO()):
+                main_bot = bot.create_bot()
+            # What the bot runs first once started
+            await main_bot.setup_hook()
+        self.addAsyncCleanup(main_bot.close)
+
+        url = "http://127.0.0.1:{port}/metrics".format(port=port)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn("ytdb_queue_depth", await response.text())
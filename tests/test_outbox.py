@@ -0,0 +1,52 @@
+"""Outbox rate limiting"""
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from benchmarks.play_bench import FakeMessageable
+from ytdb import outbox
+from ytdb.outbox import CHANNEL_RATE, Outbox
+
+from .support import wait_until
+
+# Shorter than Discord's window so the test doesn't take minutes
+WINDOW = 0.5
+
+
+class TimedMessageable(FakeMessageable):
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    async def send(self, *args, **kwargs):
+        self.times.append(time.monotonic())
+        return await super().send(*args, **kwargs)
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(outbox, "CHANNEL_PER", WINDOW))
+        self.outbox = Outbox()
+        self.destination = TimedMessageable()
+
+    async def test_spaced_out_sends_share_one_window(self):
+        for index in range(4 * CHANNEL_RATE):
+            self.outbox.send(self.destination, 1, content=str(index))
+            # Each send finds the channel's ops drained already
+            await asyncio.sleep(0.01)
+        await wait_until(lambda: len(self.destination.times) == 4 * CHANNEL_RATE)
+
+        times = self.destination.times
+        for first, last in zip(times, times[CHANNEL_RATE:]):
+            self.assertGreaterEqual(last - first, WINDOW * 0.99)
+
+    async def test_idle_buckets_are_forgotten_after_their_window(self):
+        self.outbox.send(self.destination, 1, content="first")
+        await wait_until(lambda: self.destination.times)
+        await asyncio.sleep(WINDOW)
+        self.outbox.send(self.destination, 2, content="second")
+        await wait_until(lambda: len(self.destination.times) == 2)
+        await asyncio.sleep(0)
+
+        self.assertEqual(list(self.outbox._buckets), [2])
@@ -0,0 +1,66 @@
+"""Prefetched downloads of uncached items end up played, not deleted"""
+import os
+
+from benchmarks.play_bench import FakeGuild
+from ytdb import yt_utils
+from ytdb.prefetch import Prefetcher
+from ytdb.queue_item import QueueItem
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+from .support import (
+    OfflineTestCase,
+    RecordingFFmpeg,
+    resolved_item,
+    stop_player,
+    video_url,
+    wait_until,
+)
+
+
+class UncachedPrefetchTest(OfflineTestCase):
+    audio_mode = "download"
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(RecordingFFmpeg.patch())
+        self.guild = FakeGuild(1)
+        self.channel = self.guild.channels[0]
+        self.player = YoutubeDiscordPlayer(
+            self.guild, prefetcher=Prefetcher(depth=2), idle_timeout=60
+        )
+
+    async def asyncTearDown(self):
+        await stop_player(self.player)
+
+    async def test_same_file_swapped_in_twice_is_kept(self):
+        queue_item = QueueItem(video_url(1), self.channel.id, 0)
+        await self.player.add(queue_item)
+        download_data = await yt_utils.download(video_url(1), self.player.tag)
+
+        self.player.replace_download_data(queue_item, download_data)
+        self.player.replace_download_data(queue_item, dict(download_data))
+
+        self.assertTrue(os.path.exists(queue_item.file))
+        self.assertTrue(self.player.is_ready(queue_item))
+
+    async def test_head_waits_for_the_prefetch_of_the_same_item(self):
+        # Still downloading when the short first track ends
+        self.extractor.latency = 0.3
+        await self.player.add(resolved_item(1, self.channel.id))
+        await self.player.add(QueueItem(video_url(2), self.channel.id, 0))
+        self.player.start()
+
+        sources = []
+        create_source = self.player._create_source
+
+        async def checked_source(queue_item):
+            if queue_item.file is not None:
+                sources.append((queue_item.file, os.path.exists(queue_item.file)))
+            return await create_source(queue_item)
+
+        self.player._create_source = checked_source
+        await wait_until(lambda: not self.player.queue)
+
+        self.assertEqual(self.extractor.calls, {("00000000002", True): 1})
+        self.assertEqual(len(sources), 1)
+        self.assertTrue(sources[0][1], sources)
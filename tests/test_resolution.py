@@ -0,0 +1,116 @@
+"""Play requests are queued right away and resolved in the background"""
+from unittest import mock
+
+from benchmarks.play_bench import FakeContext, FakeGuild
+from ytdb import yt_player
+from ytdb.yt_player import RESOLVE_ATTEMPTS, YoutubeCommands
+
+from .support import (
+    OfflineTestCase,
+    RecordingFFmpeg,
+    stop_player,
+    video_url,
+    wait_until,
+)
+
+
+class BackgroundResolutionTest(OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(yt_player, "RESOLVE_BACKOFF", 0.01))
+        self.enterContext(RecordingFFmpeg.patch())
+        self.cog = YoutubeCommands(None, prefetch_depth=0)
+        self.guild = FakeGuild(1)
+        self.player = self.cog._get_player(self.guild)
+
+    async def asyncTearDown(self):
+        await stop_player(self.player)
+
+    async def play(self, *videos) -> FakeContext:
+        context = FakeContext(self.guild)
+        for video in videos:
+            await self.cog.play.callback(self.cog, context, video_url(video))
+        return context
+
+    async def notices(self, context: FakeContext, count: int) -> list:
+        """Field names of the "Adding to queue" summary once all resolved"""
+
+        def fields():
+            if not context.sent:
+                return []
+            return context.sent[0].kwargs["embed"].fields
+
+        await wait_until(
+            lambda: len(fields()) == count
+            and all(field.name != "Resolving…" for field in fields())
+        )
+        return [(field.name, field.value) for field in fields()]
+
+    async def test_playing_item_that_fails_once_is_retried_and_played(self):
+        self.extractor.failures["00000000001"] = 1
+        context = await self.play(1)
+
+        notices = await self.notices(context, 1)
+        await wait_until(lambda: not self.player.queue)
+
+        self.assertEqual(notices[0][0], "Track 00000000001")
+        self.assertEqual(len(RecordingFFmpeg.created), 1)
+
+    async def test_playing_item_that_keeps_failing_is_reported_and_dropped(self):
+        self.extractor.failures["00000000001"] = RESOLVE_ATTEMPTS
+        context = await self.play(1)
+
+        notices = await self.notices(context, 1)
+        await wait_until(lambda: not self.player.queue)
+
+        self.assertEqual(notices[0][0], "Failed to add")
+        self.assertIn("Couldn't resolve it", notices[0][1])
+        self.assertEqual(RecordingFFmpeg.created, [])
+        self.assertEqual(
+            self.extractor.calls[("00000000001", False)], RESOLVE_ATTEMPTS
+        )
+
+    async def test_playing_item_left_unplayable_is_reported_and_dropped(self):
+        # Resolves fine every time, but to a url that already expired
+        self.extractor.stream_url = "https://example.invalid/{id}?expire=1".format
+        context = await self.play(1)
+
+        notices = await self.notices(context, 1)
+        await wait_until(lambda: not self.player.queue)
+
+        self.assertEqual(notices[0][0], "Failed to add")
+        self.assertIn("Couldn't resolve it", notices[0][1])
+        self.assertEqual(RecordingFFmpeg.created, [])
+
+    async def test_report_tasks_are_held_until_done(self):
+        self.extractor.gate.clear()
+        context = await self.play(1)
+        self.assertEqual(len(self.cog._reports), 1)
+
+        self.extractor.gate.set()
+        await self.notices(context, 1)
+        await wait_until(lambda: not self.cog._reports)
+
+    async def test_queued_item_that_fails_once_is_retried(self):
+        self.enterContext(mock.patch.object(RecordingFFmpeg, "FAKE_PACKETS", 500))
+        self.extractor.failures["00000000002"] = 1
+        context = await self.play(1, 2)
+
+        notices = await self.notices(context, 2)
+
+        self.assertEqual(
+            [name for name, _ in notices], ["Track 00000000001", "Track 00000000002"]
+        )
+        self.assertEqual(len(self.player.queue), 2)
+        self.assertTrue(self.player.queue[1].is_resolved)
+
+    async def test_queued_item_that_keeps_failing_is_removed(self):
+        self.enterContext(mock.patch.object(RecordingFFmpeg, "FAKE_PACKETS", 500))
+        self.extractor.failures["00000000002"] = RESOLVE_ATTEMPTS
+        context = await self.play(1, 2)
+
+        notices = await self.notices(context, 2)
+
+        self.assertEqual(notices[1][0], "Failed to add")
+        self.assertEqual(len(self.player.queue), 1)
+        self.assertEqual(self.player.queue[0].video_id, "00000000001")
@@ -0,0 +1,134 @@
+"""Seeking and resuming play the current track again from a position"""
+import os
+import subprocess
+import unittest
+from unittest import mock
+
+from benchmarks.play_bench import FakeGuild
+from ytdb import yt_player
+from ytdb.queue_item import QueueItem
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+from .support import (
+    FFMPEG,
+    FileServer,
+    OfflineTestCase,
+    RecordingFFmpeg,
+    resolved_item,
+    stop_player,
+    video_url,
+    wait_until,
+)
+
+
+class SeekTest(OfflineTestCase):
+    audio_mode = "download"
+    cache_max_bytes = 1 << 20
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(RecordingFFmpeg.patch())
+        self.guild = FakeGuild(1)
+        self.channel = self.guild.channels[0]
+        self.player = YoutubeDiscordPlayer(self.guild, idle_timeout=0)
+
+    async def asyncTearDown(self):
+        await stop_player(self.player)
+
+    async def test_seek_plays_the_file_again_from_the_position(self):
+        self.enterContext(mock.patch.object(RecordingFFmpeg, "FAKE_PACKETS", 500))
+        await self.player.add(QueueItem(video_url(1), self.channel.id, 0), resolve=True)
+        self.player.start()
+        await wait_until(lambda: self.player.elapsed > 0)
+
+        self.assertTrue(self.player.seek(30))
+        await wait_until(lambda: len(RecordingFFmpeg.created) == 2)
+
+        first, seeked = RecordingFFmpeg.created
+        self.assertEqual(seeked.source, first.source)
+        self.assertEqual(seeked.kwargs["before_options"], "-ss 30.000")
+        # Played from the downloaded file, not downloaded again
+        self.assertEqual(self.extractor.total, 1)
+        self.assertGreaterEqual(self.player.elapsed, 30)
+
+    async def test_seek_without_a_track_fails(self):
+        self.assertFalse(self.player.seek(30))
+
+
+class ResumeTest(unittest.IsolatedAsyncioTestCase):
+    """Tracks ending before their duration are played again from there"""
+
+    def setUp(self):
+        self.enterContext(RecordingFFmpeg.patch())
+        # Fake tracks last FAKE_PACKETS * 20ms = 0.1s
+        self.enterContext(mock.patch.object(yt_player, "RESUME_MIN_PROGRESS", 0.05))
+        self.enterContext(mock.patch.object(yt_player, "RESUME_EOF_MARGIN", 0.1))
+        self.guild = FakeGuild(1)
+        self.channel = self.guild.channels[0]
+        self.player = YoutubeDiscordPlayer(self.guild, idle_timeout=60)
+
+    async def asyncTearDown(self):
+        await stop_player(self.player)
+
+    async def play(self, duration: float) -> list:
+        queue_item = resolved_item(1, self.channel.id)
+        queue_item.duration = duration
+        await self.player.add(queue_item)
+        self.player.start()
+        await wait_until(lambda: not self.player.queue)
+        return RecordingFFmpeg.created
+
+    async def test_early_end_of_stream_resumes(self):
+        plays = await self.play(duration=0.35)
+
+        self.assertGreater(len(plays), 1)
+        self.assertNotIn("-ss", plays[0].kwargs["before_options"])
+        for play in plays[1:]:
+            self.assertRegex(play.kwargs["before_options"], r"^-ss \d+\.\d{3} ")
+
+    async def test_track_ending_on_time_is_not_resumed(self):
+        plays = await self.play(duration=0.1)
+
+        self.assertEqual(len(plays), 1)
+
+    async def test_unknown_duration_is_not_resumed(self):
+        plays = await self.play(duration=None)
+
+        self.assertEqual(len(plays), 1)
+
+
+@unittest.skipUnless(FFMPEG, "needs ffmpeg")
+class RangeRequestTest(OfflineTestCase):
+    """Seeking a stream asks the server for the bytes after the position"""
+
+    def setUp(self):
+        super().setUp()
+        subprocess.run(
+            [FFMPEG, "-loglevel", "error", "-f", "lavfi", "-i", "sine=duration=60"]
+            + ["-c:a", "libopus", os.path.join(self.directory, "mix.webm")],
+            check=True,
+        )
+        self.server = self.enterContext(FileServer(self.directory))
+        self.guild = FakeGuild(1)
+        self.channel = self.guild.channels[0]
+        self.player = YoutubeDiscordPlayer(self.guild, idle_timeout=0)
+
+    async def asyncTearDown(self):
+        await stop_player(self.player)
+
+    async def test_seek_requests_a_byte_range(self):
+        queue_item = resolved_item(1, self.channel.id)
+        queue_item.stream_url = self.server.url("mix.webm")
+        queue_item.start_at = 45
+        await self.player.add(queue_item)
+        self.player.start()
+        await wait_until(lambda: self.player.elapsed > queue_item.start_at + 1)
+
+        size = os.path.getsize(os.path.join(self.directory, "mix.webm"))
+        starts = [
+            int(range_header.removeprefix("bytes=").partition("-")[0])
+            for _, range_header in self.server.requests
+            if range_header is not None
+        ]
+        # Jumped well past the start instead of reading up to the position
+        self.assertTrue(any(start > size // 2 for start in starts), starts)
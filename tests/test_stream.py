@@ -0,0 +1,90 @@
+"""Stream mode plays straight from the resolved url, nothing touches the disk"""
+import os
+import subprocess
+import unittest
+
+from benchmarks.play_bench import FakeGuild
+from ytdb import yt_utils
+from ytdb.queue_item import QueueItem
+from ytdb.yt_player import FFMPEG_STREAM_BEFORE_OPTIONS, YoutubeDiscordPlayer
+
+from .support import (
+    FFMPEG,
+    FileServer,
+    OfflineTestCase,
+    RecordingFFmpeg,
+    stop_player,
+    video_url,
+    wait_until,
+)
+
+FIXTURE_BYTES = 4096
+
+
+class StreamTest(OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.served = os.path.join(self.directory, "served")
+        os.makedirs(self.served)
+        with open(os.path.join(self.served, "track.webm"), "wb") as f:
+            f.write(os.urandom(FIXTURE_BYTES))
+
+        self.server = self.enterContext(FileServer(self.served))
+        self.extractor.stream_url = lambda id: self.server.url("track.webm")
+        self.guild = FakeGuild(1)
+        self.channel = self.guild.channels[0]
+
+    def files_outside_served(self) -> list:
+        return [
+            path for path in self.written_files() if not path.startswith("served")
+        ]
+
+    async def test_download_resolves_to_the_stream_url(self):
+        download_data = await yt_utils.download(video_url(1), str(self.guild.id))
+
+        self.assertEqual(download_data["stream_url"], self.server.url("track.webm"))
+        self.assertNotIn("file", download_data)
+        self.assertEqual(self.extractor.calls, {("00000000001", False): 1})
+        self.assertEqual(self.files_outside_served(), [])
+
+    async def test_source_reads_the_url_with_reconnect_options(self):
+        player = YoutubeDiscordPlayer(self.guild)
+        download_data = await yt_utils.download(video_url(1), str(self.guild.id))
+        queue_item = QueueItem.create(download_data, self.channel.id, 0)
+        with RecordingFFmpeg.patch():
+            source = await player._create_source(queue_item)
+
+        self.assertEqual(source.source, self.server.url("track.webm"))
+        self.assertEqual(source.kwargs["before_options"], FFMPEG_STREAM_BEFORE_OPTIONS)
+        self.assertEqual(source.kwargs["codec"], "opus")
+        self.assertFalse(source.kwargs["pipe"])
+
+    async def test_plays_from_the_local_server(self):
+        player = YoutubeDiscordPlayer(self.guild, idle_timeout=0)
+        with RecordingFFmpeg.patch():
+            await player.add(QueueItem(video_url(1), self.channel.id, 0), resolve=True)
+            player.start()
+            await wait_until(lambda: RecordingFFmpeg.created and not player.queue)
+        await stop_player(player)
+
+        self.assertEqual(RecordingFFmpeg.created[0].bytes_read, FIXTURE_BYTES)
+        self.assertEqual(self.server.requests, [("/track.webm", None)])
+        self.assertEqual(self.files_outside_served(), [])
+
+    @unittest.skipUnless(FFMPEG, "needs ffmpeg")
+    async def test_plays_from_the_local_server_through_ffmpeg(self):
+        subprocess.run(
+            [FFMPEG, "-loglevel", "error", "-f", "lavfi", "-i", "sine=duration=1"]
+            + ["-c:a", "libopus", os.path.join(self.served, "sine.webm")],
+            check=True,
+        )
+        self.extractor.stream_url = lambda id: self.server.url("sine.webm")
+
+        player = YoutubeDiscordPlayer(self.guild, idle_timeout=0)
+        await player.add(QueueItem(video_url(2), self.channel.id, 0), resolve=True)
+        player.start()
+        await wait_until(lambda: self.server.requests and not player.queue)
+        await stop_player(player)
+
+        self.assertEqual(self.server.requests[0][0], "/sine.webm")
+        self.assertEqual(self.files_outside_served(), [])
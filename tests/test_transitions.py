@@ -0,0 +1,64 @@
+"""Track ends and skips hand over to the next track right away"""
+import time
+import unittest
+from unittest import mock
+
+from benchmarks.play_bench import FakeGuild, FakeVoiceClient
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+from .support import RecordingFFmpeg, resolved_item, stop_player, wait_until
+
+# Event driven transitions take well under this, polling took up to a second
+TRANSITION_BUDGET = 0.01
+
+
+class TransitionTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.enterContext(RecordingFFmpeg.patch())
+        self.guild = FakeGuild(1)
+        self.channel = self.guild.channels[0]
+        self.player = YoutubeDiscordPlayer(self.guild, idle_timeout=60)
+
+        # When each track started and when the audio thread finished it
+        self.started = []
+        self.ended = []
+        play = FakeVoiceClient.play
+
+        def timed_play(vc, source, *, after=None):
+            def timed_after(error):
+                self.ended.append(time.perf_counter())
+                after(error)
+
+            self.started.append(time.perf_counter())
+            play(vc, source, after=timed_after)
+
+        self.enterContext(mock.patch.object(FakeVoiceClient, "play", timed_play))
+
+    async def asyncTearDown(self):
+        await stop_player(self.player)
+
+    async def queue(self, count: int):
+        for index in range(count):
+            await self.player.add(resolved_item(index, self.channel.id))
+        self.player.start()
+
+    async def test_next_track_starts_as_soon_as_one_ends(self):
+        await self.queue(4)
+        await wait_until(lambda: not self.player.queue)
+
+        self.assertEqual(len(self.started), 4)
+        for ended, started in zip(self.ended, self.started[1:]):
+            self.assertLess(started - ended, TRANSITION_BUDGET)
+
+    async def test_skip_starts_the_next_track_right_away(self):
+        self.enterContext(mock.patch.object(RecordingFFmpeg, "FAKE_PACKETS", 500))
+        await self.queue(2)
+        await wait_until(lambda: self.started)
+
+        skipped = time.perf_counter()
+        self.player.skip()
+        await wait_until(lambda: len(self.started) == 2)
+
+        self.assertLess(self.started[1] - skipped, TRANSITION_BUDGET)
+        self.assertIs(self.player.current, self.player.queue[0])
+        self.assertEqual(len(self.player.queue), 1)
@@ -0,0 +1,67 @@
+"""Voice connections stay open between tracks"""
+import unittest
+
+from benchmarks.play_bench import FakeGuild, FakeVoiceChannel
+from ytdb import metrics
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+from .support import RecordingFFmpeg, resolved_item, stop_player, wait_until
+
+
+class VoiceSessionTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.enterContext(RecordingFFmpeg.patch())
+        self.guild = FakeGuild(1)
+        self.general = self.guild.channels[0]
+        self.music = FakeVoiceChannel(13, "Music", self.guild)
+        self.guild.channels.append(self.music)
+        self.player = YoutubeDiscordPlayer(self.guild, idle_timeout=60)
+
+    async def asyncTearDown(self):
+        await stop_player(self.player)
+
+    async def play(self, *channels):
+        gaps = metrics.snapshot()["stages"].get("track_gap") or {"count": 0, "sum": 0}
+        for index, channel in enumerate(channels):
+            await self.player.add(resolved_item(index, channel.id))
+        self.player.start()
+        await wait_until(lambda: not self.player.queue)
+
+        # Mean silence between two tracks, None when there was only one
+        after = metrics.snapshot()["stages"].get("track_gap") or gaps
+        if after["count"] == gaps["count"]:
+            return None
+        return (after["sum"] - gaps["sum"]) / (after["count"] - gaps["count"])
+
+    async def test_back_to_back_tracks_share_one_handshake(self):
+        gap = await self.play(self.general, self.general, self.general)
+
+        self.assertEqual(self.player.voice.handshakes, 1)
+        self.assertEqual(self.player.voice.moves, 0)
+        # FakeVoiceChannel.connect takes 50ms, reconnecting would show here
+        self.assertLess(gap, 0.025)
+
+    async def test_other_channel_moves_instead_of_reconnecting(self):
+        await self.play(self.general, self.general, self.music)
+
+        self.assertEqual(self.player.voice.handshakes, 1)
+        self.assertEqual(self.player.voice.moves, 1)
+        self.assertIs(self.guild.voice_client.channel, self.music)
+
+    async def test_queue_running_dry_keeps_the_connection_until_idle(self):
+        await self.play(self.general)
+        await self.play(self.general)
+
+        self.assertEqual(self.player.voice.handshakes, 1)
+        self.assertTrue(self.guild.voice_client.is_connected())
+
+    async def test_stop_during_the_handshake_leaves_nothing_connected(self):
+        await self.player.add(resolved_item(0, self.general.id))
+        self.player.start()
+        await wait_until(lambda: self.player.current is not None)
+
+        await self.player.stop()
+        await wait_until(lambda: self.player.current is None)
+
+        self.assertIsNone(self.guild.voice_client)
+        self.assertEqual(RecordingFFmpeg.created, [])
@@ -0,0 +1,320 @@
+"""Audio Cache
+    - Keeps downloaded audio on disk by video id so repeat requests skip yt-dlp
+    - Evicts least recently used files once the byte budget is exceeded, the
+      budget covers the whole directory however many processes share it
+    - Never evicts files any process sharing the directory has pinned
+
+"""
+import fcntl
+import json
+import os
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+
+class AudioCache:
+    """Content-addressed (by video id) LRU cache of downloaded audio files
+
+    Every entry is an audio file `<id>.<ext>` plus a `<id>.json` sidecar
+    holding the download data so a hit never needs yt-dlp. Files are first
+    written to `tmp_directory` and moved in with an atomic rename, so several
+    processes can share the directory and pick up each other's entries.
+    Eviction scans the directory, so `max_bytes` holds for all of them
+    together.
+
+    Pins show up in the directory as well, `.pins/<owner>/<id>`, next to an
+    `<owner>.lock` its process holds a lock on while alive. Pins of owners
+    whose lock is free belong to a dead process and get cleaned up.
+    """
+
+    def __init__(self, directory: str = "audio_cache", max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.tmp_directory = os.path.join(directory, ".tmp")
+        self.max_bytes = max_bytes
+
+        # Counters for sizing max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # video id -> (download_data, size), LRU first
+        self._pins = Counter()  # video id -> queue items still using the file
+        self._size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.tmp_directory, exist_ok=True)
+        self.pin_directory = os.path.join(directory, ".pins")
+        self._evict_lock = os.path.join(directory, ".evict.lock")
+        self._own_pins = os.path.join(
+            self.pin_directory,
+            "{pid}-{token}".format(pid=os.getpid(), token=os.urandom(4).hex()),
+        )
+        self._owner_lock = None
+        self._lock_owner()
+        self._load()
+
+    def _lock_owner(self):
+        """Holds this cache's owner lock until the process dies or close"""
+        os.makedirs(self._own_pins)
+        name = os.path.basename(self._own_pins)
+        tmp_path = os.path.join(self.tmp_directory, "{name}.lock".format(name=name))
+        self._owner_lock = open(tmp_path, "w")
+        fcntl.flock(self._owner_lock, fcntl.LOCK_EX)
+        # Only shows up once locked, so nobody takes it for a dead owner's
+        os.replace(tmp_path, self._own_pins + ".lock")
+
+    def close(self):
+        """Drops this cache's pins from the directory and its owner lock"""
+        with self._lock:
+            shutil.rmtree(self._own_pins, ignore_errors=True)
+            try:
+                os.remove(self._own_pins + ".lock")
+            except FileNotFoundError:
+                pass
+            self._owner_lock.close()
+
+    def _sidecar(self, video_id: str) -> str:
+        return os.path.join(self.directory, "{id}.json".format(id=video_id))
+
+    def _load(self):
+        """Rebuilds the index from what is already on disk, oldest use first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r") as f:
+                    download_data = json.load(f)
+                size = os.path.getsize(download_data["file"])
+                found.append((os.path.getmtime(path), download_data, size))
+            except (OSError, ValueError, KeyError):
+                # Half written or orphaned entry
+                os.remove(path)
+
+        for _, download_data, size in sorted(found, key=lambda entry: entry[0]):
+            self._entries[download_data["id"]] = (download_data, size)
+            self._size += size
+
+    def _adopt(self, video_id: str) -> tuple:
+        """Indexes an entry another process sharing the directory cached"""
+        try:
+            with open(self._sidecar(video_id), "r") as f:
+                download_data = json.load(f)
+            size = os.path.getsize(download_data["file"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+        entry = self._entries[video_id] = (download_data, size)
+        self._size += size
+        return entry
+
+    def _write_sidecar(self, download_data: dict):
+        path = self._sidecar(download_data["id"])
+        # NOTE: other processes may share the cache directory
+        tmp_path = os.path.join(
+            self.tmp_directory,
+            "{name}.{pid}.part".format(name=os.path.basename(path), pid=os.getpid()),
+        )
+        with open(tmp_path, "w") as f:
+            json.dump(download_data, f)
+        os.replace(tmp_path, path)
+
+    def _pinned_elsewhere(self) -> set:
+        """Video ids other live caches sharing the directory have pinned"""
+        pinned = set()
+        for name in os.listdir(self.pin_directory):
+            owner, ext = os.path.splitext(name)
+            owner = os.path.join(self.pin_directory, owner)
+            if ext != ".lock" or owner == self._own_pins:
+                continue
+
+            try:
+                with open(owner + ".lock", "r") as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        # Its process is alive
+                        pinned.update(os.listdir(owner))
+                        continue
+
+                    # Died without unpinning
+                    shutil.rmtree(owner, ignore_errors=True)
+                    os.remove(owner + ".lock")
+            except FileNotFoundError:
+                # Cleaned up in the meantime
+                pass
+        return pinned
+
+    def _pin(self, video_id: str):
+        self._pins[video_id] += 1
+        if self._pins[video_id] == 1:
+            open(os.path.join(self._own_pins, video_id), "w").close()
+
+    def _scan(self) -> list:
+        """(last use, video id, size, file) of every entry in the directory,
+        whichever process wrote it, oldest use first
+        """
+        used = {}  # video id -> sidecar mtime
+        files = {}  # video id -> (file, size)
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                video_id, ext = os.path.splitext(entry.name)
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted in the meantime
+                    continue
+
+                if ext == ".json":
+                    used[video_id] = stat.st_mtime
+                else:
+                    files[video_id] = (entry.path, stat.st_size)
+
+        return sorted(
+            (used[video_id], video_id, size, file)
+            for video_id, (file, size) in files.items()
+            if video_id in used
+        )
+
+    def _evict(self):
+        """Evicts least recently used entries until everything in the
+        directory fits the budget, not just what this process indexed
+        """
+        # NOTE: one process at a time, they'd evict the same entries twice
+        with open(self._evict_lock, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries = self._scan()
+            total = sum(size for _, _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+
+            elsewhere = self._pinned_elsewhere()
+            for _, video_id, size, file in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._pins[video_id] > 0 or video_id in elsewhere:
+                    # Queued or playing right now, here or in another process
+                    continue
+
+                total -= size
+                self.evictions += 1
+                entry = self._entries.pop(video_id, None)
+                if entry is not None:
+                    self._size -= entry[1]
+                for path in (self._sidecar(video_id), file):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def get(self, video_id: str) -> dict:
+        """Looks up a cached file and pins it
+
+        Args:
+            video_id (str): Youtube video id
+
+        Returns:
+            dict: Download data for the cached file or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                entry = self._adopt(video_id)
+            elif not os.path.exists(entry[0]["file"]):
+                # Evicted by another process
+                del self._entries[video_id]
+                self._size -= entry[1]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(video_id)
+            self._pin(video_id)
+
+        # Persist recency for the next startup
+        os.utime(self._sidecar(video_id))
+        return dict(entry[0], cached=True)
+
+    def put(self, tmp_file: str, download_data: dict) -> dict:
+        """Moves a finished download into the cache and pins it
+
+        Args:
+            tmp_file (str): Finished download inside of tmp_directory
+            download_data (dict): Download data to keep alongside the file
+
+        Returns:
+            dict: Download data pointing at the cached file
+        """
+        video_id = download_data["id"]
+        _, ext = os.path.splitext(tmp_file)
+        file = os.path.join(self.directory, "{id}{ext}".format(id=video_id, ext=ext))
+        download_data = dict(download_data, file=file)
+
+        os.replace(tmp_file, file)
+        self._write_sidecar(download_data)
+        size = os.path.getsize(file)
+
+        with self._lock:
+            old = self._entries.pop(video_id, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[video_id] = (download_data, size)
+            self._size += size
+            self._pin(video_id)
+            self._evict()
+
+        return dict(download_data, cached=True)
+
+    def annotate(self, video_id: str, **fields):
+        """Adds fields to an entry's download data, persisted in its sidecar
+
+        Args:
+            video_id (str): Youtube video id
+            **fields: Fields to add
+        """
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None:
+                # Evicted in the meantime
+                return
+            download_data = dict(entry[0], **fields)
+            self._entries[video_id] = (download_data, entry[1])
+
+        self._write_sidecar(download_data)
+
+    def unpin(self, video_id: str):
+        """Releases a pin taken by get or put so the file can be evicted
+
+        Args:
+            video_id (str): Youtube video id
+        """
+        with self._lock:
+            self._pins[video_id] -= 1
+            if self._pins[video_id] <= 0:
+                del self._pins[video_id]
+                try:
+                    os.remove(os.path.join(self._own_pins, video_id))
+                except FileNotFoundError:
+                    pass
+            self._evict()
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,83 @@
+"""Channel Index
+    - Finds voice channels by name without scanning every channel of a guild
+    - Kept current from channel create/update/delete events
+
+"""
+import bisect
+
+import discord
+
+
+class _GuildChannels:
+    def __init__(self, channels: list):
+        self.by_name = {}  # casefolded name -> channels in guild order
+        self._names = None  # sorted casefolded names, built on demand
+        for channel in channels:
+            self.add(channel)
+
+    def add(self, channel: discord.VoiceChannel):
+        self.by_name.setdefault(channel.name.casefold(), []).append(channel)
+        self._names = None
+
+    def remove(self, channel: discord.VoiceChannel):
+        name = channel.name.casefold()
+        channels = [c for c in self.by_name.get(name, ()) if c.id != channel.id]
+        if channels:
+            self.by_name[name] = channels
+        else:
+            self.by_name.pop(name, None)
+        self._names = None
+
+    def find(self, name: str) -> discord.VoiceChannel:
+        name = name.casefold()
+        channels = self.by_name.get(name)
+        if channels:
+            return channels[0]
+
+        if self._names is None:
+            self._names = sorted(self.by_name)
+        # First name (alphabetically) starting with name
+        index = bisect.bisect_left(self._names, name)
+        if index < len(self._names) and self._names[index].startswith(name):
+            return self.by_name[self._names[index]][0]
+        return None
+
+
+class ChannelIndex:
+    """Per guild index of voice channels by case insensitive name
+
+    A guild is indexed on its first lookup, after that lookups are dict
+    hits and only channel events touch the index.
+    """
+
+    def __init__(self):
+        self._guilds = {}  # guild id -> _GuildChannels
+
+    def find(self, guild: discord.Guild, name: str) -> discord.VoiceChannel:
+        """Finds a voice channel by exact name, or else by name prefix,
+        ignoring case
+
+        Args:
+            guild (discord.Guild): Guild to look in
+            name (str): Channel name or the start of it
+
+        Returns:
+            discord.VoiceChannel: The channel or None
+        """
+        if guild.id not in self._guilds:
+            self._guilds[guild.id] = _GuildChannels(guild.voice_channels)
+        return self._guilds[guild.id].find(name)
+
+    def add(self, channel: discord.VoiceChannel):
+        """Indexes a created channel"""
+        if channel.guild.id in self._guilds:
+            self._guilds[channel.guild.id].add(channel)
+
+    def remove(self, channel: discord.VoiceChannel):
+        """Forgets a deleted channel"""
+        if channel.guild.id in self._guilds:
+            self._guilds[channel.guild.id].remove(channel)
+
+    def forget(self, guild: discord.Guild):
+        """Drops a guild the bot left"""
+        self._guilds.pop(guild.id, None)
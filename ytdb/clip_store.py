@@ -0,0 +1,95 @@
+"""Clip Store
+    - Keeps short clips in memory instead of writing them to disk
+    - Caps how many bytes all guilds hold in memory together
+
+"""
+import threading
+
+
+class ClipStore:
+    """Byte budget for in-memory clips shared by every guild
+
+    Space is reserved from the reported file size before fetching, then
+    settled with the real size once held. The same clip object held by
+    several queue items is only counted once.
+    """
+
+    def __init__(self, clip_max_bytes: int = 2 << 20, max_bytes: int = 64 << 20):
+        self.clip_max_bytes = clip_max_bytes
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+        # Metrics
+        self.clips = 0
+        self.disk_bytes_avoided = 0
+
+        self._refs = {}  # id of clip -> [clip, queue items holding it]
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int) -> bool:
+        """Reserves room for a clip about to be fetched
+
+        Args:
+            size (int): Reported size of the clip
+
+        Returns:
+            bool: False when the clip is too big or the budget is used up
+        """
+        with self._lock:
+            if size > self.clip_max_bytes or self.bytes + size > self.max_bytes:
+                return False
+            self.bytes += size
+            return True
+
+    def cancel(self, size: int):
+        """Gives back a reservation whose fetch didn't pan out
+
+        Args:
+            size (int): Size passed to reserve
+        """
+        with self._lock:
+            self.bytes -= size
+
+    def hold(self, clip: bytes, reserved: int = 0):
+        """Counts a queue item holding the clip
+
+        Args:
+            clip (bytes): The clip
+            reserved (int, optional): Reservation made for it. Defaults to 0.
+        """
+        with self._lock:
+            ref = self._refs.get(id(clip))
+            if ref is None:
+                self._refs[id(clip)] = [clip, 1]
+                self.bytes += len(clip) - reserved
+                self.clips += 1
+                self.disk_bytes_avoided += len(clip)
+            else:
+                # Already counted
+                self.bytes -= reserved
+                ref[1] += 1
+
+    def release(self, clip: bytes):
+        """A queue item is done with the clip, frees it once nobody holds it
+
+        Args:
+            clip (bytes): The clip
+        """
+        with self._lock:
+            ref = self._refs[id(clip)]
+            ref[1] -= 1
+            if ref[1] == 0:
+                del self._refs[id(clip)]
+                self.bytes -= len(clip)
+
+    def stats(self) -> dict:
+        """Memory counters"""
+        with self._lock:
+            return {
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "clip_max_bytes": self.clip_max_bytes,
+                "held_clips": len(self._refs),
+                "clips": self.clips,
+                "disk_bytes_avoided": self.disk_bytes_avoided,
+            }
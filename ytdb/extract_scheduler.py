@@ -0,0 +1,150 @@
+"""Extract Scheduler
+    - Runs blocking yt-dlp work on its own bounded thread pool
+    - Serves guilds round robin so one guild's burst can't starve the rest
+
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExtractCancelled(Exception):
+    """Raised for pending work dropped through ExtractScheduler.cancel
+
+    Work shared between guilds can be dropped by another guild's cancel,
+    `tag` tells whose it was.
+    """
+
+    def __init__(self, tag: str):
+        super().__init__(tag)
+        self.tag = tag
+
+
+class ExtractScheduler:
+    """Fair queue in front of a dedicated thread pool
+
+    Work is queued per tag (guild id) and a free worker always takes the
+    oldest job of the next tag in rotation.
+    """
+
+    def __init__(self, max_workers: int = 4, initializer=None):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="ytdb-extract",
+            initializer=initializer,
+        )
+        self._pending = OrderedDict()  # tag -> deque of jobs, in rotation order
+        self._running = 0
+
+        # Metrics
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, tag: str, fn):
+        """Runs fn on the pool once it is tag's turn
+
+        Args:
+            tag (str): Tag of who the work is for (guild id)
+            fn (Callable[[], Any]): Blocking work
+
+        Raises:
+            ExtractCancelled: When cancel(tag) dropped the job before it started
+
+        Returns:
+            Any: Whatever fn returns
+        """
+        loop = asyncio.get_running_loop()
+        job = (fn, loop.create_future(), time.monotonic())
+        self._pending.setdefault(tag, deque()).append(job)
+        self.submitted += 1
+        self._dispatch(loop)
+
+        try:
+            return await job[1]
+        except asyncio.CancelledError:
+            # Caller went away, don't spend a worker on it
+            self._discard(tag, job)
+            raise
+
+    def warm(self):
+        """Starts every worker thread now so the initializer runs up front"""
+        # Each job holds its thread until all threads exist
+        barrier = threading.Barrier(self.max_workers)
+        for _ in range(self.max_workers):
+            self._executor.submit(barrier.wait, 5)
+
+    def cancel(self, tag: str):
+        """Drops all of tag's jobs that haven't started yet
+
+        Args:
+            tag (str): Tag of who the work is for (guild id)
+        """
+        for _, future, _ in self._pending.pop(tag, ()):
+            if not future.done():
+                future.set_exception(ExtractCancelled(tag))
+                self.cancelled += 1
+
+    def stats(self) -> dict:
+        """Queue depth and wait time metrics"""
+        started = self.completed + self._running
+        return {
+            "workers": self.max_workers,
+            "running": self._running,
+            "queue_depth": sum(len(jobs) for jobs in self._pending.values()),
+            "queued_guilds": len(self._pending),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "avg_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    def _discard(self, tag: str, job: tuple):
+        jobs = self._pending.get(tag)
+        if jobs is not None and job in jobs:
+            jobs.remove(job)
+            self.cancelled += 1
+            if not jobs:
+                del self._pending[tag]
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop):
+        while self._running < self.max_workers and self._pending:
+            tag, jobs = next(iter(self._pending.items()))
+            fn, future, queued_at = jobs.popleft()
+
+            # Back of the rotation
+            if jobs:
+                self._pending.move_to_end(tag)
+            else:
+                del self._pending[tag]
+
+            if future.done():
+                continue
+
+            wait = time.monotonic() - queued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            self._running += 1
+            self._executor.submit(fn).add_done_callback(
+                lambda done, future=future: loop.call_soon_threadsafe(
+                    self._finish, loop, done, future
+                )
+            )
+
+    def _finish(self, loop, done, future: asyncio.Future):
+        self._running -= 1
+        self.completed += 1
+        if not future.done():
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+
+        self._dispatch(loop)
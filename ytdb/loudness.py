@@ -0,0 +1,136 @@
+"""Loudness
+    - Measures every cached track once with FFmpeg's loudnorm filter
+    - The resulting gain is kept in the cache entry's sidecar so playback
+      only applies a cheap volume change
+
+"""
+import asyncio
+import json
+
+from .audio_cache import AudioCache
+
+# Integrated loudness (LUFS) and true peak (dBTP) tracks get brought to
+LOUDNESS_TARGET = -16.0
+TRUE_PEAK = -1.5
+MAX_GAIN_DB = 12.0
+
+# Smaller gains aren't worth giving up Opus passthrough for
+MIN_GAIN_DB = 1.0
+
+
+def gain_db(measured: dict, target: float = LOUDNESS_TARGET) -> float:
+    """Gets the gain bringing a track to target without clipping
+
+    Args:
+        measured (dict): loudnorm's first pass output
+        target (float, optional): Integrated loudness to reach.
+            Defaults to LOUDNESS_TARGET.
+
+    Returns:
+        float: Gain in dB
+    """
+    gain = target - float(measured["input_i"])
+    # Never push the true peak over TRUE_PEAK
+    gain = min(gain, TRUE_PEAK - float(measured["input_tp"]), MAX_GAIN_DB)
+    return round(max(gain, -MAX_GAIN_DB), 2)
+
+
+class LoudnessAnalyzer:
+    """Background loudness analysis of cached tracks
+
+    At most `max_concurrency` FFmpeg processes run at once and at most
+    `max_pending` tracks wait for one, anything beyond that is measured
+    the next time it is played.
+    """
+
+    def __init__(
+        self,
+        cache: AudioCache,
+        target: float = LOUDNESS_TARGET,
+        max_concurrency: int = 1,
+        max_pending: int = 64,
+    ):
+        self.cache = cache
+        self.target = target
+        self.max_pending = max_pending
+
+        # Metrics
+        self.analyzed = 0
+        self.failed = 0
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = {}  # video id -> analysis task
+
+    def schedule(self, download_data: dict):
+        """Measures a cached track unless it already has a gain
+
+        Args:
+            download_data (dict): Download data of a cache entry
+        """
+        video_id = download_data["id"]
+        if (
+            "gain_db" in download_data
+            or video_id in self._pending
+            or len(self._pending) >= self.max_pending
+        ):
+            return
+
+        self._pending[video_id] = asyncio.create_task(
+            self._analyze(video_id, download_data["file"])
+        )
+
+    async def _analyze(self, video_id: str, file: str):
+        try:
+            async with self._semaphore:
+                measured = await self._measure(file)
+            self.cache.annotate(video_id, gain_db=gain_db(measured, self.target))
+            self.analyzed += 1
+        except Exception as e:
+            print(e)
+            self.failed += 1
+        finally:
+            del self._pending[video_id]
+
+    async def _measure(self, file: str) -> dict:
+        """Runs loudnorm's first pass over file
+
+        Raises:
+            RuntimeError: FFmpeg failed
+        """
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-nostats",
+            "-i",
+            file,
+            "-vn",
+            "-af",
+            "loudnorm=I={target}:TP={peak}:print_format=json".format(
+                target=self.target, peak=TRUE_PEAK
+            ),
+            "-f",
+            "null",
+            "-",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(
+                "Loudness analysis of {file} failed with {code}".format(
+                    file=file, code=process.returncode
+                )
+            )
+
+        # The measurement is the last JSON object FFmpeg prints
+        output = stderr.decode(errors="replace")
+        return json.loads(output[output.rindex("{") : output.rindex("}") + 1])
+
+    def stats(self) -> dict:
+        """Analysis counters"""
+        return {
+            "analyzed": self.analyzed,
+            "failed": self.failed,
+            "pending": len(self._pending),
+            "target": self.target,
+        }
@@ -0,0 +1,170 @@
+"""Metadata Cache
+    - Keeps resolved extract_info metadata around so repeat lookups skip yt-dlp
+    - Optionally backed by SQLite so it survives restarts
+
+"""
+import json
+import sqlite3
+import time
+from urllib.parse import parse_qs, urlparse
+
+from .single_flight import single_flight
+
+# Signed stream urls stop working at their `expire` param, entries are
+# dropped this many seconds before that so FFmpeg never gets a dead url
+EXPIRY_MARGIN = 600
+
+# Expired entries nobody looks up again are swept out at most this often
+SWEEP_INTERVAL = 60
+
+
+def url_expiry(stream_url: str) -> float:
+    """Gets when a signed stream url stops working
+
+    Args:
+        stream_url (str): Direct url of an audio format
+
+    Returns:
+        float: Unix timestamp or None when the url isn't signed
+    """
+    try:
+        return float(parse_qs(urlparse(stream_url).query)["expire"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+class MetadataCache:
+    """TTL cache of resolved metadata keyed by the normalized user input
+
+    Concurrent lookups of the same key share one resolution.
+    """
+
+    def __init__(self, ttl: float = 3600, db_path: str = None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}  # key -> (expires, metadata)
+        self._inflight = {}  # key -> Future of the running resolution
+        self._next_sweep = time.time() + SWEEP_INTERVAL
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata"
+                " (key TEXT PRIMARY KEY, expires REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self._db.execute("DELETE FROM metadata WHERE expires <= ?", (time.time(),))
+            self._db.commit()
+
+    def _expires(self, metadata: dict) -> float:
+        expires = time.time() + self.ttl
+        signed_until = url_expiry(metadata.get("url") or "")
+        if signed_until is not None:
+            expires = min(expires, signed_until - EXPIRY_MARGIN)
+        return expires
+
+    def get(self, key: str) -> dict:
+        """Gets unexpired metadata without resolving
+
+        Args:
+            key (str): Normalized input
+
+        Returns:
+            dict: The metadata or None
+        """
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT expires, data FROM metadata WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                entry = (row[0], json.loads(row[1]))
+                self._entries[key] = entry
+
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self.invalidate(key)
+            return None
+        return entry[1]
+
+    def set(self, key: str, metadata: dict):
+        """Stores metadata until its ttl or stream url runs out
+
+        Args:
+            key (str): Normalized input
+            metadata (dict): Resolved metadata
+        """
+        now = time.time()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        expires = self._expires(metadata)
+        if expires <= now:
+            return
+
+        self._entries[key] = (expires, metadata)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO metadata (key, expires, data) VALUES (?, ?, ?)",
+                (key, expires, json.dumps(metadata)),
+            )
+            self._db.commit()
+
+    def _sweep(self, now: float):
+        """Drops every expired entry, every distinct input would stay in
+        memory otherwise
+        """
+        self._next_sweep = now + SWEEP_INTERVAL
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+
+        if self._db is not None:
+            self._db.execute("DELETE FROM metadata WHERE expires <= ?", (now,))
+            self._db.commit()
+
+    def invalidate(self, key: str):
+        """Drops a cached entry
+
+        Args:
+            key (str): Normalized input
+        """
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            self._db.commit()
+
+    async def get_or_resolve(self, key: str, resolver) -> dict:
+        """Gets cached metadata or resolves it once for every concurrent caller
+
+        Args:
+            key (str): Normalized input
+            resolver (Callable[[], Awaitable[dict]]): Resolves the metadata on a miss
+
+        Returns:
+            dict: The metadata
+        """
+        metadata = self.get(key)
+        if metadata is not None:
+            self.hits += 1
+            return metadata
+
+        self.misses += 1
+        return await single_flight(
+            self._inflight, key, lambda: self._resolve(key, resolver)
+        )
+
+    async def _resolve(self, key: str, resolver) -> dict:
+        metadata = await resolver()
+        self.set(key, metadata)
+        return metadata
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
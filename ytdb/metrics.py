@@ -0,0 +1,176 @@
+"""Metrics
+    - Latency histograms per stage of a play request, counters and gauges
+    - Served Prometheus style over local HTTP or dumped as JSON
+
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Upper bounds in seconds, the last bucket is everything above
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    """Bucketed latency histogram"""
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        """Adds one observation"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        """Cumulative counts per upper bound like Prometheus has them"""
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> Histogram
+_counters = Counter()
+_gauges = {}  # name -> callable returning a number or a dict of numbers
+
+
+def observe(stage: str, seconds: float):
+    """Records how long a stage took
+
+    Args:
+        stage (str): Name of the stage
+        seconds (float): How long it took
+    """
+    with _lock:
+        if stage not in _histograms:
+            _histograms[stage] = Histogram()
+        _histograms[stage].observe(seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Times the wrapped block as one observation of stage
+
+    Args:
+        stage (str): Name of the stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def inc(name: str, value: int = 1):
+    """Bumps a counter
+
+    Args:
+        name (str): Name of the counter
+        value (int, optional): How much to add. Defaults to 1.
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def gauge(name: str, fn):
+    """Registers a gauge read whenever metrics get collected
+
+    Args:
+        name (str): Name of the gauge
+        fn (Callable[[], float | dict]): Current value, dicts become one
+            gauge per key
+    """
+    _gauges[name] = fn
+
+
+def _gauge_values() -> dict:
+    values = {}
+    for name, fn in list(_gauges.items()):
+        value = fn()
+        if isinstance(value, dict):
+            for key, sub_value in value.items():
+                if isinstance(sub_value, (int, float)):
+                    values["{name}_{key}".format(name=name, key=key)] = sub_value
+        elif value is not None:
+            values[name] = value
+    return values
+
+
+def snapshot() -> dict:
+    """Everything collected so far"""
+    with _lock:
+        histograms = {
+            stage: histogram.to_dict() for stage, histogram in _histograms.items()
+        }
+        counters = dict(_counters)
+
+    return {"stages": histograms, "counters": counters, "gauges": _gauge_values()}
+
+
+def render_prometheus() -> str:
+    """Everything collected so far in Prometheus text format"""
+    data = snapshot()
+    lines = [
+        "# TYPE ytdb_stage_seconds histogram",
+    ]
+    for stage, histogram in data["stages"].items():
+        for bound, count in histogram["buckets"].items():
+            lines.append(
+                'ytdb_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}'.format(
+                    stage=stage, bound=bound, count=count
+                )
+            )
+        lines.append(
+            'ytdb_stage_seconds_sum{{stage="{stage}"}} {sum}'.format(
+                stage=stage, sum=histogram["sum"]
+            )
+        )
+        lines.append(
+            'ytdb_stage_seconds_count{{stage="{stage}"}} {count}'.format(
+                stage=stage, count=histogram["count"]
+            )
+        )
+
+    for name, value in data["counters"].items():
+        lines.append("# TYPE ytdb_{name}_total counter".format(name=name))
+        lines.append("ytdb_{name}_total {value}".format(name=name, value=value))
+
+    for name, value in data["gauges"].items():
+        lines.append("# TYPE ytdb_{name} gauge".format(name=name))
+        lines.append("ytdb_{name} {value}".format(name=name, value=value))
+
+    return "\n".join(lines) + "\n"
+
+
+async def start_server(port: int, host: str = "127.0.0.1") -> web.AppRunner:
+    """Serves /metrics on a local port
+
+    Args:
+        port (int): Port to listen on
+        host (str, optional): Interface to bind. Defaults to "127.0.0.1".
+
+    Returns:
+        web.AppRunner: Runner to clean up on shutdown
+    """
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render_prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
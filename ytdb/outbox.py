@@ -0,0 +1,244 @@
+"""Outbox
+    - Sends command replies in the background so handlers return right away
+    - Keeps every channel under its rate limit, in order
+    - Folds bursts of "Adding to queue" notices into one edited message
+
+"""
+import asyncio
+import time
+from collections import deque
+
+import discord
+
+from . import metrics
+
+# Discord lets a channel take about this many messages per window
+CHANNEL_RATE = 5
+CHANNEL_PER = 5.0
+
+# Notices join the last summary while it is this young and nothing else
+# was sent to the channel in between
+COALESCE_WINDOW = 10.0
+SUMMARY_MAX_ENTRIES = 10
+
+
+class _Bucket:
+    """Sliding window rate limit of one route"""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._sent = deque()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            while self._sent and now - self._sent[0] >= self.per:
+                self._sent.popleft()
+            if len(self._sent) < self.rate:
+                self._sent.append(now)
+                return
+            await asyncio.sleep(self.per - (now - self._sent[0]))
+
+    def idle(self, now: float) -> bool:
+        """Whether everything sent has left the window"""
+        return not self._sent or now - self._sent[-1] >= self.per
+
+
+class Notice:
+    """One "Adding to queue" entry, updated in place once it resolves"""
+
+    __slots__ = ("requester", "title", "url", "failure", "summary")
+
+    def __init__(self, requester: discord.abc.User, title: str, url: str):
+        self.requester = requester
+        # None while still resolving
+        self.title = title
+        self.url = url
+        self.failure = None
+        self.summary = None
+
+
+class _Summary:
+    """One "Adding to queue" message listing every notice folded into it"""
+
+    def __init__(self, destination, channel_id: int):
+        self.destination = destination
+        self.channel_id = channel_id
+        self.entries = []  # Notices
+        self.message = None
+        self.opened = time.monotonic()
+        # Whether a send/edit is already waiting in the channel's ops
+        self.scheduled = False
+
+    def embed(self) -> discord.Embed:
+        author = self.entries[0].requester
+        embed = discord.Embed(title="Adding to queue")
+        embed.set_author(name=author.display_name, icon_url=author.display_avatar.url)
+        for notice in self.entries:
+            name = notice.title or "Resolving…"
+            value = notice.url
+            if notice.failure is not None:
+                name = "Failed to add"
+                value = "{url}\n{failure}".format(url=value, failure=notice.failure)
+            if notice.requester.id != author.id:
+                value = "{value}\nrequested by {name}".format(
+                    value=value, name=notice.requester.display_name
+                )
+            embed.add_field(name=name, value=value, inline=False)
+        return embed
+
+
+class _Channel:
+    def __init__(self):
+        self.ops = deque()
+        self.task = None
+        # Summary notices may still join
+        self.summary = None
+
+
+class Outbox:
+    """Per channel queues of outgoing messages, drained by one task each"""
+
+    def __init__(self):
+        self._channels = {}  # channel id -> _Channel
+        # Outlive the channel's ops until their window is over
+        self._buckets = {}  # channel id -> _Bucket
+        self._next_prune = time.monotonic()
+
+    def _channel(self, channel_id: int) -> _Channel:
+        if channel_id not in self._channels:
+            self._channels[channel_id] = _Channel()
+        return self._channels[channel_id]
+
+    def _bucket(self, channel_id: int) -> _Bucket:
+        if channel_id not in self._buckets:
+            self._buckets[channel_id] = _Bucket(CHANNEL_RATE, CHANNEL_PER)
+        return self._buckets[channel_id]
+
+    def _prune(self):
+        """Forgets the buckets of channels nothing was sent to for a window,
+        at most once a window
+        """
+        now = time.monotonic()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + CHANNEL_PER
+
+        idle = [
+            channel_id
+            for channel_id, bucket in self._buckets.items()
+            if bucket.idle(now) and channel_id not in self._channels
+        ]
+        for channel_id in idle:
+            del self._buckets[channel_id]
+
+    def _schedule(self, channel_id: int, op):
+        channel = self._channel(channel_id)
+        channel.ops.append(op)
+        if channel.task is None:
+            channel.task = asyncio.create_task(self._drain(channel_id, channel))
+
+    async def _drain(self, channel_id: int, channel: _Channel):
+        while channel.ops:
+            op = channel.ops.popleft()
+            await self._bucket(channel_id).acquire()
+            try:
+                await op()
+                metrics.inc("messages_sent")
+            except Exception as e:
+                print(e)
+
+        channel.task = None
+        if channel.summary is None or not self._is_open(channel.summary):
+            del self._channels[channel_id]
+        self._prune()
+
+    def _is_open(self, summary: _Summary) -> bool:
+        return (
+            time.monotonic() - summary.opened < COALESCE_WINDOW
+            and len(summary.entries) < SUMMARY_MAX_ENTRIES
+        )
+
+    def send(self, destination, channel_id: int, **kwargs):
+        """Queues a message, returns without waiting for it to be sent
+
+        Args:
+            destination (discord.abc.Messageable | discord.Webhook):
+                Context, channel or interaction followup to send through
+            channel_id (int): Channel the message ends up in
+            **kwargs: Passed to destination.send
+        """
+        channel = self._channel(channel_id)
+        # Later notices must not edit a message above this one
+        channel.summary = None
+        self._schedule(channel_id, lambda: destination.send(**kwargs))
+
+    def add_to_queue(
+        self,
+        destination,
+        channel_id: int,
+        requester: discord.abc.User,
+        title: str,
+        url: str,
+        join: bool = True,
+    ) -> Notice:
+        """Queues an "Adding to queue" notice, folding it into the channel's
+        last summary when that is still open
+
+        Args:
+            destination (discord.abc.Messageable | discord.Webhook):
+                Where a new summary gets sent
+            channel_id (int): Channel the message ends up in
+            requester (discord.abc.User): Who queued it
+            title (str): Title of what was queued, None while resolving
+            url (str): Url of what was queued
+            join (bool, optional): Whether the notice may join an existing
+                summary, deferred interactions need their own message.
+                Defaults to True.
+
+        Returns:
+            Notice: Handle for update
+        """
+        channel = self._channel(channel_id)
+        summary = channel.summary
+        if not join or summary is None or not self._is_open(summary):
+            summary = channel.summary = _Summary(destination, channel_id)
+        else:
+            metrics.inc("messages_coalesced")
+
+        notice = Notice(requester, title, url)
+        notice.summary = summary
+        summary.entries.append(notice)
+        self._schedule_flush(summary)
+        return notice
+
+    def update(
+        self, notice: Notice, title: str = None, url: str = None, failure: str = None
+    ):
+        """Edits a notice in place, e.g. once what it announced resolved
+
+        Args:
+            notice (Notice): Returned by add_to_queue
+            title (str, optional): Resolved title. Defaults to None (unchanged).
+            url (str, optional): Resolved url. Defaults to None (unchanged).
+            failure (str, optional): Why it didn't get queued. Defaults to None.
+        """
+        notice.title = title or notice.title
+        notice.url = url or notice.url
+        notice.failure = failure
+        self._schedule_flush(notice.summary)
+
+    def _schedule_flush(self, summary: _Summary):
+        if not summary.scheduled:
+            summary.scheduled = True
+            self._schedule(summary.channel_id, lambda: self._flush(summary))
+
+    async def _flush(self, summary: _Summary):
+        # Notices arriving from here on need another edit
+        summary.scheduled = False
+        embed = summary.embed()
+        if summary.message is None:
+            summary.message = await summary.destination.send(embed=embed)
+        else:
+            await summary.message.edit(embed=embed)
@@ -0,0 +1,54 @@
+"""Prefetching
+    - Keeps upcoming queue items resolved/downloaded while the current one plays
+
+"""
+import asyncio
+import itertools
+
+from .yt_utils import download
+
+
+class Prefetcher:
+    """Gets the next `depth` items of every guild's queue ready to play
+
+    All guilds share one limit of `max_concurrency` running prefetches.
+    """
+
+    def __init__(self, depth: int = 2, max_concurrency: int = 4):
+        self.depth = depth
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = {}  # id of queue item -> prefetch task
+
+    def schedule(self, player):
+        """Starts prefetching whatever isn't ready right after the playing item
+
+        Args:
+            player (YoutubeDiscordPlayer): Player whose queue to look ahead in
+        """
+        for item in itertools.islice(player.queue, 1, 1 + self.depth):
+            if (
+                id(item) in self._tasks
+                or player.is_ready(item)
+                or player.is_resolving(item)
+            ):
+                continue
+
+            self._tasks[id(item)] = asyncio.create_task(self._prefetch(player, item))
+
+    def prefetching(self, item) -> asyncio.Task:
+        """The task prefetching item, None unless one is running"""
+        return self._tasks.get(id(item))
+
+    async def _prefetch(self, player, item):
+        try:
+            async with self._semaphore:
+                # Skipped or stopped while waiting for a free slot
+                if not item.queued:
+                    return
+                download_data = await download(item.url, player.tag)
+
+            player.replace_download_data(item, download_data)
+        except Exception as e:
+            print(e)
+        finally:
+            del self._tasks[id(item)]
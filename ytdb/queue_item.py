@@ -0,0 +1,80 @@
+"""Queue Item
+    - Compact representation of one queued track
+
+"""
+from dataclasses import dataclass
+
+
+@dataclass(slots=True, eq=False)
+class QueueItem:
+    """One queued track
+
+    Only holds ids and resolved playback data, no Context/Interaction
+    objects, so long queues stay small. Items compare by identity.
+    """
+
+    url: str
+    channel_id: int
+    requester_id: int
+    video_id: str = None
+    title: str = None
+    file: str = None
+    stream_url: str = None
+    # Whole clip kept in memory, see ClipStore
+    clip: bytes = None
+    acodec: str = None
+    # Length in seconds as reported by the extractor, None when unknown
+    duration: float = None
+    # Loudness correction measured for cached tracks, see LoudnessAnalyzer
+    gain_db: float = None
+    cached: bool = False
+    # Seconds into the track playback starts at, see seek
+    start_at: float = 0.0
+    # Whether the item is still in its player's queue
+    queued: bool = False
+
+    @classmethod
+    def create(
+        cls, download_data: dict, channel_id: int, requester_id: int
+    ) -> "QueueItem":
+        """Creates an item from what download/iter_playlist returned
+
+        Args:
+            download_data (dict): Data that came from the youtube download
+            channel_id (int): Id of the voice channel to play in
+            requester_id (int): Id of the member who asked for it
+
+        Returns:
+            QueueItem: The item
+        """
+        item = cls(
+            url=download_data["url"], channel_id=channel_id, requester_id=requester_id
+        )
+        item.apply(download_data)
+        return item
+
+    def apply(self, download_data: dict):
+        """Takes over freshly resolved/downloaded data
+
+        Args:
+            download_data (dict): Data that came from the youtube download
+        """
+        self.url = download_data["url"]
+        self.video_id = download_data["id"]
+        self.title = download_data["title"]
+        self.file = download_data.get("file")
+        self.stream_url = download_data.get("stream_url")
+        self.clip = download_data.get("clip")
+        self.acodec = download_data.get("acodec")
+        self.duration = download_data.get("duration")
+        self.gain_db = download_data.get("gain_db")
+        self.cached = download_data.get("cached", False)
+
+    @property
+    def is_resolved(self) -> bool:
+        """Whether there is anything to play, placeholders have neither"""
+        return (
+            self.file is not None
+            or self.stream_url is not None
+            or self.clip is not None
+        )
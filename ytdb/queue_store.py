@@ -0,0 +1,165 @@
+"""Queue Store
+    - Persists every guild's queue to SQLite so a restart picks up where it left
+    - Writes changed queues in batches from a background task
+
+"""
+import asyncio
+import sqlite3
+import time
+
+from .queue_item import QueueItem
+
+# Seconds between batched writes, at most this much is lost on a crash
+FLUSH_INTERVAL = 1.0
+
+
+class QueueStore:
+    """SQLite copy of the players' queues
+
+    Only what is needed to queue the items again is kept. Cached files are
+    found again through the audio cache, uncached downloads by their path.
+    """
+
+    def __init__(self, db_path: str):
+        # NOTE: only ever used by one thread at a time
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL keeps the last committed batch intact when the process dies
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS players"
+            " (guild_id INTEGER PRIMARY KEY, elapsed REAL NOT NULL,"
+            " saved REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS queue_items"
+            " (guild_id INTEGER NOT NULL, position INTEGER NOT NULL,"
+            " url TEXT NOT NULL, channel_id INTEGER NOT NULL,"
+            " requester_id INTEGER NOT NULL,"
+            " video_id TEXT, title TEXT, file TEXT, acodec TEXT,"
+            " PRIMARY KEY (guild_id, position))"
+        )
+        self._db.commit()
+
+        # Metrics
+        self.flushes = 0
+
+        self._saved_versions = {}  # guild id -> player version last written
+
+    def load(self) -> dict:
+        """Reads back what was saved, blocking
+
+        Returns:
+            dict: guild id -> (elapsed seconds of the first item, QueueItems)
+        """
+        saved = {}
+        for guild_id, elapsed in self._db.execute(
+            "SELECT guild_id, elapsed FROM players"
+        ):
+            saved[guild_id] = (elapsed, [])
+
+        rows = self._db.execute(
+            "SELECT guild_id, url, channel_id, requester_id, video_id, title, file,"
+            " acodec FROM queue_items ORDER BY guild_id, position"
+        )
+        for row in rows:
+            if row[0] not in saved:
+                continue
+            url, channel_id, requester_id, video_id, title, file, acodec = row[1:]
+            saved[row[0]][1].append(
+                QueueItem(
+                    url,
+                    channel_id,
+                    requester_id,
+                    video_id=video_id,
+                    title=title,
+                    file=file,
+                    acodec=acodec,
+                )
+            )
+        return saved
+
+    def _snapshot(self, players: dict) -> list:
+        """Rows of every player whose queue changed since the last flush"""
+        changes = []
+        for guild_id, player in list(players.items()):
+            changed = self._saved_versions.get(guild_id) != player.version
+            if not changed and player.current is None:
+                continue
+
+            self._saved_versions[guild_id] = player.version
+            rows = None
+            if changed:
+                rows = [
+                    (
+                        guild_id,
+                        position,
+                        item.url,
+                        item.channel_id,
+                        item.requester_id,
+                        item.video_id,
+                        item.title,
+                        # Cached files get pinned again through the cache
+                        None if item.cached else item.file,
+                        item.acodec,
+                    )
+                    for position, item in enumerate(player.queue)
+                ]
+            changes.append((guild_id, len(player.queue), player.elapsed, rows))
+        return changes
+
+    def _write(self, changes: list):
+        now = time.time()
+        with self._db:
+            for guild_id, length, elapsed, rows in changes:
+                if length == 0:
+                    self._db.execute(
+                        "DELETE FROM players WHERE guild_id = ?", (guild_id,)
+                    )
+                else:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO players (guild_id, elapsed, saved)"
+                        " VALUES (?, ?, ?)",
+                        (guild_id, elapsed, now),
+                    )
+
+                if rows is not None:
+                    self._db.execute(
+                        "DELETE FROM queue_items WHERE guild_id = ?", (guild_id,)
+                    )
+                    self._db.executemany(
+                        "INSERT INTO queue_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+        self.flushes += 1
+
+    async def flush(self, players: dict):
+        """Writes every changed queue in one transaction off the event loop
+
+        Args:
+            players (dict): guild id -> YoutubeDiscordPlayer
+        """
+        changes = self._snapshot(players)
+        if changes:
+            await asyncio.to_thread(self._write, changes)
+
+    async def run(self, players: dict):
+        """Flushes every FLUSH_INTERVAL seconds until cancelled
+
+        Args:
+            players (dict): guild id -> YoutubeDiscordPlayer
+        """
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush(players)
+            except Exception as e:
+                print(e)
+
+    def close(self):
+        """Closes the database"""
+        self._db.close()
+
+    def stats(self) -> dict:
+        """Store counters"""
+        return {"flushes": self.flushes, "guilds": len(self._saved_versions)}
@@ -0,0 +1,112 @@
+"""Queue View
+    - Renders a queue as compact pages, many entries per embed
+    - Buttons flip through pages by editing the one message
+
+"""
+from collections import OrderedDict
+
+import discord
+
+QUEUE_PAGE_SIZE = 10
+TITLE_MAX_LENGTH = 80
+
+# (tag, queue version, page) -> Embed, recently used last
+_pages = OrderedDict()
+_PAGES_MAX = 256
+
+
+def page_count(player) -> int:
+    """How many pages the player's queue needs, at least one"""
+    return max(1, -(-len(player.queue) // QUEUE_PAGE_SIZE))
+
+
+def _render(player, page: int) -> discord.Embed:
+    start = page * QUEUE_PAGE_SIZE
+    lines = []
+    for index, item in enumerate(
+        list(player.queue)[start : start + QUEUE_PAGE_SIZE], start
+    ):
+        title = item.title or item.url
+        if len(title) > TITLE_MAX_LENGTH:
+            title = title[: TITLE_MAX_LENGTH - 1] + "…"
+        lines.append(
+            "`{index}.` [{title}]({url}) · `{channel}`{playing}".format(
+                index=index,
+                title=title,
+                url=item.url,
+                channel=player.guild.get_channel(item.channel_id),
+                playing=" · playing" if item is player.current else "",
+            )
+        )
+
+    embed = discord.Embed(title="Queue", description="\n".join(lines))
+    embed.set_footer(
+        text="Page {page}/{pages} · {count} items".format(
+            page=page + 1, pages=page_count(player), count=len(player.queue)
+        )
+    )
+    return embed
+
+
+def render_page(player, page: int) -> discord.Embed:
+    """Gets one page of the queue, rendered once per queue version
+
+    Args:
+        player (YoutubeDiscordPlayer): Player whose queue to show
+        page (int): Zero based page, clamped to the existing ones
+
+    Returns:
+        discord.Embed: The page
+    """
+    page = min(max(page, 0), page_count(player) - 1)
+    key = (player.tag, player.version, page)
+    embed = _pages.get(key)
+    if embed is None:
+        embed = _pages[key] = _render(player, page)
+        if len(_pages) > _PAGES_MAX:
+            _pages.popitem(last=False)
+    else:
+        _pages.move_to_end(key)
+    return embed
+
+
+class QueueView(discord.ui.View):
+    """Previous/next buttons under a queue page"""
+
+    def __init__(self, player, page: int = 0, timeout: float = 180.0):
+        super().__init__(timeout=timeout)
+        self.player = player
+        self.page = page
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        self.page = min(max(page, 0), page_count(self.player) - 1)
+        await interaction.response.edit_message(
+            embed=render_page(self.player, self.page), view=self
+        )
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await self._show(interaction, self.page + 1)
+
+
+def queue_message(player) -> dict:
+    """Send kwargs for the first page, with buttons only when there are more
+
+    Args:
+        player (YoutubeDiscordPlayer): Player whose queue to show
+
+    Returns:
+        dict: embed and, for multi page queues, view
+    """
+    message = {"embed": render_page(player, 0)}
+    if page_count(player) > 1:
+        message["view"] = QueueView(player)
+    return message
@@ -0,0 +1,39 @@
+"""Single Flight
+    - Lets concurrent callers asking for the same thing share one run
+
+"""
+import asyncio
+
+
+async def single_flight(inflight: dict, key, fn):
+    """Runs fn unless a run for key is already going, then waits on that one
+
+    Args:
+        inflight (dict): key -> Future of the running call, owned by the caller
+        key (Hashable): What is being asked for
+        fn (Callable[[], Awaitable[Any]]): Does the actual work
+
+    Returns:
+        Any: Whatever the shared run of fn returned
+    """
+    future = inflight.get(key)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    # Nobody else waiting is fine, don't warn about it
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    inflight[key] = future
+    try:
+        result = await fn()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as ex:
+        future.set_exception(ex)
+        raise
+    finally:
+        inflight.pop(key, None)
+
+    future.set_result(result)
+    return result
@@ -0,0 +1,77 @@
+"""Voice Session
+    - Keeps a guild's voice connection open between tracks
+
+"""
+import asyncio
+
+import discord
+
+from . import metrics
+
+
+class VoiceSession:
+    """One guild's voice connection
+
+    Connects once, moves between channels when the next track targets a
+    different one and disconnects after idle_timeout seconds without use.
+    """
+
+    def __init__(self, idle_timeout: float = 60.0):
+        self.idle_timeout = idle_timeout
+        self.voice_client = None
+
+        # Metrics
+        self.handshakes = 0
+        self.moves = 0
+
+        self._idle_task = None
+
+    def _cancel_idle(self):
+        if self._idle_task is not None:
+            self._idle_task.cancel()
+            self._idle_task = None
+
+    async def ensure(self, channel: discord.VoiceChannel) -> discord.VoiceClient:
+        """Gets a voice client connected to channel, reusing the open one
+
+        Args:
+            channel (discord.VoiceChannel): Channel to play in
+
+        Returns:
+            discord.VoiceClient: Connected voice client
+        """
+        self._cancel_idle()
+
+        vc = self.voice_client or channel.guild.voice_client
+        if vc is not None and vc.is_connected():
+            if vc.channel.id != channel.id:
+                with metrics.span("voice_connect"):
+                    await vc.move_to(channel)
+                self.moves += 1
+            self.voice_client = vc
+            return vc
+
+        with metrics.span("voice_connect"):
+            self.voice_client = await channel.connect()
+        self.handshakes += 1
+        return self.voice_client
+
+    def release(self):
+        """Nothing to play right now, disconnect unless used again in time"""
+        self._cancel_idle()
+        if self.voice_client is not None:
+            self._idle_task = asyncio.create_task(self._disconnect_when_idle())
+
+    async def _disconnect_when_idle(self):
+        await asyncio.sleep(self.idle_timeout)
+        # Don't let disconnect cancel this task
+        self._idle_task = None
+        await self.disconnect()
+
+    async def disconnect(self):
+        """Disconnects right away"""
+        self._cancel_idle()
+        vc, self.voice_client = self.voice_client, None
+        if vc is not None:
+            with metrics.span("disconnect"):
+                await vc.disconnect()
@@ -0,0 +1,68 @@
+"""YoutubeDL Pool
+    - Reuses YoutubeDL instances instead of building one per request
+
+"""
+import os
+import threading
+
+import yt_dlp as youtube_dl
+
+
+class YoutubeDLPool:
+    """Thread confined YoutubeDL instances, one per option set per thread
+
+    YoutubeDL isn't safe to share between threads, so every worker thread
+    gets its own instances. They are rebuilt only once the cookie file they
+    were created with changes on disk.
+    """
+
+    def __init__(self):
+        self.created = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(ydl_opts: dict) -> str:
+        return repr(sorted(ydl_opts.items()))
+
+    @staticmethod
+    def _cookie_stamp(ydl_opts: dict) -> float:
+        try:
+            return os.path.getmtime(ydl_opts["cookiefile"])
+        except (KeyError, OSError):
+            return None
+
+    def get(self, ydl_opts: dict) -> youtube_dl.YoutubeDL:
+        """Gets this thread's instance for the option set
+
+        Args:
+            ydl_opts (dict): YoutubeDL options
+
+        Returns:
+            youtube_dl.YoutubeDL: Instance only to be used on the calling thread
+        """
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+
+        key = self._key(ydl_opts)
+        stamp = self._cookie_stamp(ydl_opts)
+        entry = instances.get(key)
+        if entry is None or entry[0] != stamp:
+            # NOTE: the old instance isn't closed, closing saves its stale
+            # cookies over the new cookie file
+            entry = (stamp, youtube_dl.YoutubeDL(dict(ydl_opts)))
+            instances[key] = entry
+            with self._lock:
+                self.created += 1
+
+        return entry[1]
+
+    def warm(self, *option_sets: dict):
+        """Builds this thread's instances ahead of the first request
+
+        Args:
+            option_sets (dict): YoutubeDL options to build instances for
+        """
+        for ydl_opts in option_sets:
+            self.get(ydl_opts)
@@ -1,116 +1,528 @@
 """Discord-Youtube player and discord bot cog housing script
 """
 
+import dataclasses
+import io
+import json
 import os
 
 import asyncio
+import time
+from collections import Counter, deque
 import discord
 from discord.ext import commands
-from .yt_utils import download
+from . import metrics
+from .channel_index import ChannelIndex
+from .metadata_cache import EXPIRY_MARGIN, url_expiry
+from .outbox import Notice, Outbox
+from .prefetch import Prefetcher
+from .queue_item import QueueItem
+from .queue_store import QueueStore
+from .queue_view import queue_message
+from .voice_session import VoiceSession
+from .extract_scheduler import ExtractCancelled
+from .loudness import MIN_GAIN_DB
+from .yt_utils import (
+    download,
+    get_audio_cache,
+    get_clip_store,
+    get_loudness,
+    get_metadata_cache,
+    get_scheduler,
+    iter_playlist,
+)
+
+# Lets FFmpeg recover from dropped connections while reading a stream url
+FFMPEG_STREAM_BEFORE_OPTIONS = (
+    "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+)
+FFMPEG_OPTIONS = "-vn"
+
+# Unplayable items get resolved again this many times before being dropped
+RESOLVE_ATTEMPTS = 3
+RESOLVE_BACKOFF = 1.0
+
+# Tracks cut off by an error resume where they stopped, unless they barely
+# got anywhere since the last try
+RESUME_MIN_PROGRESS = 5.0
+# FFmpeg exits cleanly when a stream drops for good, tracks ending more than
+# this many seconds before their duration count as cut off too
+RESUME_EOF_MARGIN = 5.0
+
+
+def parse_position(position: str) -> float:
+    """Reads `90`, `1:30` or `1:01:30` as seconds
+
+    Raises:
+        ValueError: Not a position
+    """
+    seconds = 0.0
+    for part in position.split(":"):
+        seconds = seconds * 60 + float(part)
+    if not 0 <= seconds < float("inf"):
+        raise ValueError(position)
+    return seconds
+
+
+def format_position(seconds: float) -> str:
+    """Formats seconds as `m:ss`"""
+    minutes, seconds = divmod(int(seconds), 60)
+    return "{minutes}:{seconds:02d}".format(minutes=minutes, seconds=seconds)
+
+
+class _FirstPacketTimer(discord.AudioSource):
+    """Passes audio through and calls on_first_packet once it is read"""
+
+    def __init__(self, original: discord.AudioSource, on_first_packet):
+        self.original = original
+        self.on_first_packet = on_first_packet
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if self.on_first_packet is not None:
+            # Runs on discord.py's audio thread
+            self.on_first_packet()
+            self.on_first_packet = None
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
 
 
 class YoutubeDiscordPlayer:
     """Class for keeping track of youtube music/sound queue"""
 
-    def __init__(self):
-        self.queue = []
+    def __init__(
+        self,
+        guild: discord.Guild,
+        prefetcher: Prefetcher = None,
+        idle_timeout: float = 60.0,
+    ):
+        self.guild = guild
+        self.tag = str(guild.id)
+        self.prefetcher = prefetcher
+        self.voice = VoiceSession(idle_timeout=idle_timeout)
+        self.queue = deque()
+        self.current = None
         self.is_playing = False
-        self.is_stopping = False
-        self.skip_song = False
-
-    def _can_play(self, queue_item) -> bool:
-        if (
-            "channel" in queue_item
-            and "download_data" in queue_item
-            and "file" in queue_item["download_data"]
-        ):
+        # Bumped whenever what the queue shows changes, see queue_view
+        self.version = 0
+        # Bumped by stop so anything still adding to the queue can tell
+        self.generation = 0
+        # Set by skip/stop, ends the playing track right away
+        self.skip_song = asyncio.Event()
+
+        # Consumer task waits on this while the queue is empty
+        self._not_empty = asyncio.Condition()
+        self._consumer = None
+        # file -> queued items using it
+        self._file_refs = Counter()
+        # When the last track ended, None once the queue ran dry
+        self._last_track_end = None
+        # When the current track started playing
+        self._track_started = None
+        # Set by seek, the current track gets played again from there
+        self._seek_to = None
+        # Item queued before it was resolved -> task resolving it
+        self._resolving = {}
+
+    def is_ready(self, queue_item: QueueItem) -> bool:
+        """Whether the item can start playing without resolving it again"""
+        if not queue_item.is_resolved:
+            return False
+
+        if queue_item.clip is not None:
             return True
+        if queue_item.file is not None:
+            return os.path.exists(queue_item.file)
 
-        return False
+        expires = url_expiry(queue_item.stream_url)
+        return expires is None or expires - EXPIRY_MARGIN > time.time()
 
-    # TODO: Maybe make what this takes to be more concise...
-    def add(self, url, channel, download_data, context=None, interaction=None):
-        """Add song to queue
+    def replace_download_data(self, queue_item: QueueItem, download_data: dict):
+        """Swaps in freshly resolved/downloaded data for a queued item
 
         Args:
-            url (str): The url of the youtube video
-            context (_type_): Discord context
-            channel (_type_): Discord channel object
-            download_data (_type_): Data that came from the youtube download
+            queue_item (QueueItem): Item in the queue
+            download_data (dict): Data that came from the youtube download
+        """
+        if not queue_item.queued:
+            # Dropped from the queue in the meantime
+            self._drop_file(QueueItem.create(download_data, 0, 0))
+            return
+
+        # Held before the old data is released, both may use the same file
+        old_item = dataclasses.replace(queue_item)
+        queue_item.apply(download_data)
+        self._hold(queue_item)
+        self._release(old_item)
+        self.version += 1
+
+    def _hold(self, queue_item: QueueItem):
+        if queue_item.file is not None:
+            self._file_refs[queue_item.file] += 1
+
+    def _release(self, queue_item: QueueItem):
+        """Gives up the queue item's hold on its file"""
+        if queue_item.file is not None:
+            self._file_refs[queue_item.file] -= 1
+            if self._file_refs[queue_item.file] <= 0:
+                del self._file_refs[queue_item.file]
+
+        self._drop_file(queue_item)
+
+    def _drop_file(self, queue_item: QueueItem):
+        """Cached files get unpinned so the cache can evict them, anything
+        else is removed once no queued item uses it anymore
         """
-        self.queue.append(
-            {
-                "url": url,
-                "context": context,
-                "channel": channel,
-                "download_data": download_data,
-                "interaction": interaction,
-            }
+        if queue_item.clip is not None:
+            get_clip_store().release(queue_item.clip)
+        elif queue_item.cached:
+            get_audio_cache().unpin(queue_item.video_id)
+        elif (
+            queue_item.file is not None
+            and queue_item.file not in self._file_refs
+            and os.path.exists(queue_item.file)
+        ):
+            # NOTE: streamed items never touch the disk
+            os.remove(queue_item.file)
+
+    async def _create_source(self, queue_item: QueueItem) -> discord.AudioSource:
+        """Opus audio is copied straight through, anything else gets encoded
+        to Opus by FFmpeg instead of sending PCM through discord.py
+        """
+        pipe = queue_item.clip is not None
+        if pipe:
+            # Fed to FFmpeg through stdin, never touches the disk
+            source = io.BytesIO(queue_item.clip)
+            before_options = None
+        elif queue_item.stream_url is not None:
+            source = queue_item.stream_url
+            before_options = FFMPEG_STREAM_BEFORE_OPTIONS
+        else:
+            source = queue_item.file
+            before_options = None
+
+        if queue_item.start_at > 0:
+            # As an input option FFmpeg seeks the file, or asks the server
+            # for the range after the position, instead of decoding up to it
+            before_options = "-ss {start_at:.3f} {options}".format(
+                start_at=queue_item.start_at, options=before_options or ""
+            ).strip()
+
+        gain_db = queue_item.gain_db
+        if gain_db is not None and abs(gain_db) >= MIN_GAIN_DB:
+            # Filters need decoded audio, these get encoded again
+            return discord.FFmpegOpusAudio(
+                source,
+                pipe=pipe,
+                before_options=before_options,
+                options="{options} -af volume={gain_db}dB".format(
+                    options=FFMPEG_OPTIONS, gain_db=gain_db
+                ),
+            )
+
+        if queue_item.acodec is None and not pipe:
+            # Codec wasn't known when resolved, let ffprobe tell
+            return await discord.FFmpegOpusAudio.from_probe(
+                source, before_options=before_options, options=FFMPEG_OPTIONS
+            )
+
+        # NOTE: FFmpegOpusAudio copies the packets when codec is "opus"
+        return discord.FFmpegOpusAudio(
+            source,
+            codec=queue_item.acodec,
+            pipe=pipe,
+            before_options=before_options,
+            options=FFMPEG_OPTIONS,
         )
 
+    async def _prepare(self, queue_item: QueueItem):
+        """Makes sure the item is ready to play
+
+        Raises:
+            Exception: Why it can't be played, after retrying
+        """
+        resolving = self._resolving.get(queue_item)
+        if resolving is not None:
+            # Resolving since it was queued, failures there were retried already
+            await resolving
+        elif self.prefetcher is not None:
+            prefetching = self.prefetcher.prefetching(queue_item)
+            if prefetching is not None:
+                # Takes over its download instead of starting a second one
+                await asyncio.wait([prefetching])
+        await self._resolve(queue_item)
+
+    async def _resolve(self, queue_item: QueueItem):
+        """Resolves/downloads the item unless it is ready, retrying with backoff
+
+        Items resolved in the background since they were queued and items
+        resolved right before they play get the same retries.
+
+        Raises:
+            Exception: Whatever the last failed attempt raised, RuntimeError
+                when every attempt went through but left nothing playable
+        """
+        for attempt in range(RESOLVE_ATTEMPTS):
+            # Safe guard just incase something happens to the file or the
+            # stream url expired while queued
+            if self.is_ready(queue_item) or not queue_item.queued:
+                return
+
+            try:
+                self.replace_download_data(
+                    queue_item, await download(queue_item.url, self.tag)
+                )
+            except ExtractCancelled:
+                raise
+            except Exception as e:
+                if attempt == RESOLVE_ATTEMPTS - 1:
+                    raise
+                print(e)
+                metrics.inc("resolve_retries")
+                await asyncio.sleep(RESOLVE_BACKOFF * 2**attempt)
+
+        if not self.is_ready(queue_item) and queue_item.queued:
+            raise RuntimeError(
+                "Nothing playable for {url} after {attempts} attempts".format(
+                    url=queue_item.url, attempts=RESOLVE_ATTEMPTS
+                )
+            )
+
+    async def add(
+        self, queue_item: QueueItem, resolve: bool = False
+    ) -> asyncio.Task:
+        """Add song to queue and wake up the player
+
+        Args:
+            queue_item (QueueItem): What to play
+            resolve (bool, optional): Start resolving the item in the
+                background right away. Defaults to False.
+
+        Returns:
+            asyncio.Task: The background resolution, raises whatever the
+                last attempt raised once the player gave up on the item.
+                None unless resolve is set.
+        """
+        task = None
+        async with self._not_empty:
+            queue_item.queued = True
+            self._hold(queue_item)
+            self.queue.append(queue_item)
+            self.version += 1
+            if resolve:
+                task = asyncio.create_task(self._resolve_queued(queue_item))
+                self._resolving[queue_item] = task
+            self._not_empty.notify()
+
+        if self.is_playing and self.prefetcher is not None:
+            self.prefetcher.schedule(self)
+        return task
+
+    async def _resolve_queued(self, queue_item: QueueItem):
+        try:
+            await self._resolve(queue_item)
+        finally:
+            del self._resolving[queue_item]
+
+    def is_resolving(self, queue_item: QueueItem) -> bool:
+        """Whether the item is being resolved in the background"""
+        return queue_item in self._resolving
+
+    def remove(self, queue_item: QueueItem):
+        """Takes an item out of the queue unless it is already playing
+
+        Args:
+            queue_item (QueueItem): Item in the queue
+        """
+        if not queue_item.queued or queue_item is self.current:
+            return
+
+        self.queue.remove(queue_item)
+        queue_item.queued = False
+        self.version += 1
+        self._release(queue_item)
+
+    @property
+    def elapsed(self) -> float:
+        """Position in the current track in seconds, 0 when nothing plays"""
+        if self._track_started is None:
+            return 0.0
+        return self.current.start_at + time.monotonic() - self._track_started
+
+    def seek(self, position: float) -> bool:
+        """Plays the current track again from position
+
+        Args:
+            position (float): Seconds into the track
+
+        Returns:
+            bool: False when nothing is playing
+        """
+        if self._track_started is None:
+            return False
+
+        self._seek_to = position
+        self.skip_song.set()
+        return True
+
     def skip(self):
-        """Sets skip_song which gets checked while song is running"""
-        self.skip_song = True
+        """Sets skip_song which ends the song that is running"""
+        self.skip_song.set()
 
-    async def start(self):
-        """Starts playing from the queue. Ends once the queue is empty"""
-        self.is_playing = True
-        self.is_stopping = False
+    def start(self):
+        """Starts the player's consumer task unless it is already running
 
-        while len(self.queue) != 0:
-            next_video = self.queue[0]
-            if self._can_play(next_video):
-                await self.play_and_pop(next_video)
+        It plays the queue in order and waits cheaply for more once the
+        queue runs out, so callers never wait on it.
+        """
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.create_task(self._consume())
 
-        self.is_playing = False
+    async def _consume(self):
+        while True:
+            async with self._not_empty:
+                if len(self.queue) == 0:
+                    self.is_playing = False
+                    self._last_track_end = None
+                    self.voice.release()
+                    await self._not_empty.wait_for(lambda: len(self.queue) != 0)
+
+                self.is_playing = True
+                self.current = self.queue[0]
+                self.version += 1
+
+            await self.play_and_pop(self.current)
+            self.current = None
 
     async def stop(self):
         """Stops the queue and resets"""
-        self.queue = []
-        self.is_stopping = True
-        self.is_playing = False
-        self.skip_song = True
+        self.generation += 1
+
+        # Nothing queued for this guild needs resolving anymore
+        get_scheduler().cancel(self.tag)
+
+        dropped = list(self.queue)
+        self.queue.clear()
+        self.version += 1
+        for item in dropped:
+            item.queued = False
+            # The current item gets released once play_and_pop finishes
+            if item is not self.current:
+                self._release(item)
 
-    async def play_and_pop(self, play_info):
+        if self.current is not None:
+            self.skip_song.set()
+        await self.voice.disconnect()
+
+    async def play_and_pop(self, play_info: QueueItem):
         """Plays audio file from play_info and then removes from the queue
 
+        Items that still can't be played after retrying are dropped.
+
         Args:
-            play_info (dict): Dictionary holding information about what to play
+            play_info (QueueItem): What to play
         """
-        # Safe guard just incase something happens to the file
-        file = play_info["download_data"]["file"]
-        if not os.path.exists(file):
-            download_data = await download(play_info["url"])
-            file = download_data["file"]
+        loop = asyncio.get_running_loop()
+        finished = asyncio.Event()
+        errors = []
+        requested = time.perf_counter()
+        last_track_end = self._last_track_end
+
+        def first_packet():
+            now = time.perf_counter()
+            metrics.observe("first_audio", now - requested)
+            if last_track_end is not None:
+                # Silence between two tracks of the same queue
+                metrics.observe("track_gap", now - last_track_end)
+
+        def after(error):
+            # Runs on discord.py's audio thread
+            if error is not None:
+                print(error)
+                errors.append(error)
+            loop.call_soon_threadsafe(finished.set)
+
+        waits = []
+        skipped = False
+        try:
+            await self._prepare(play_info)
+            if not play_info.queued:
+                # Stopped in the meantime
+                return
 
-        # Channel connect and Source creation
-        vc = await play_info["channel"].connect()
-        source = discord.FFmpegPCMAudio(file)
+            # Channel connect (or reuse/move) and Source creation
+            vc = await self.voice.ensure(self.guild.get_channel(play_info.channel_id))
+            if not play_info.queued:
+                # Stopped while connecting, stop disconnected before that
+                await self.voice.disconnect()
+                return
+            source = _FirstPacketTimer(
+                await self._create_source(play_info), first_packet
+            )
 
-        # PLAY
-        try:
-            vc.play(source)
-            while vc.is_playing():
-                if self.skip_song:
-                    vc.stop()
-                    self.skip_song = False
-                await asyncio.sleep(1.0)
+            # PLAY
+            vc.play(source, after=after)
+            playing = time.perf_counter()
+            self._track_started = time.monotonic()
+            if self.prefetcher is not None:
+                self.prefetcher.schedule(self)
+
+            # Wake up as soon as the track ends or gets skipped
+            waits = [
+                asyncio.create_task(finished.wait()),
+                asyncio.create_task(self.skip_song.wait()),
+            ]
+            await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            skipped = self.skip_song.is_set()
+            if skipped:
+                vc.stop()
+            metrics.observe("track", time.perf_counter() - playing)
         except Exception as e:
             print(e)
+            metrics.inc("play_errors")
         finally:
-            if not self.is_stopping:
-                self.queue.pop(0)
-
-            # Only remove files that aren't in the queue for future use
-            files = [
-                item["download_data"]["file"]
-                for item in self.queue
-                if self._can_play(item)
-            ]
-            if not file in files:
-                os.remove(file)
+            elapsed = self.elapsed
+            self._last_track_end = time.perf_counter()
+            self._track_started = None
+            for wait in waits:
+                wait.cancel()
+            self.skip_song.clear()
+
+            seek_to, self._seek_to = self._seek_to, None
+            ended_early = (
+                not skipped
+                and play_info.duration is not None
+                and play_info.duration - elapsed > RESUME_EOF_MARGIN
+            )
+            if (
+                seek_to is None
+                and (errors or ended_early)
+                and elapsed - play_info.start_at >= RESUME_MIN_PROGRESS
+            ):
+                # Cut off mid track, e.g. the stream connection died
+                seek_to = elapsed
+                metrics.inc("resumes")
+
+            if seek_to is not None and play_info.queued:
+                # Still the head of the queue, the consumer plays it again
+                play_info.start_at = seek_to
+            else:
+                if play_info.queued:
+                    play_info.queued = False
+                    self.queue.popleft()
+                    self.version += 1
 
-            await vc.disconnect()
+                # Only remove files that aren't in the queue for future use
+                self._release(play_info)
+
+
+def _stats(cache) -> dict:
+    return None if cache is None else cache.stats()
 
 
 class YoutubeCommands(commands.Cog):
@@ -120,134 +532,250 @@ class YoutubeCommands(commands.Cog):
         commands (_type_): Cog base class
     """
 
-    def __init__(self, bot: commands.Bot):
+    def __init__(
+        self,
+        bot: commands.Bot,
+        prefetch_depth: int = 2,
+        prefetch_concurrency: int = 4,
+        idle_timeout: float = 60.0,
+        metrics_port: int = 0,
+        queue_db: str = None,
+    ):
         self.bot = bot
         self.players = {}
+        self.idle_timeout = idle_timeout
+        self.prefetcher = None
+        if prefetch_depth > 0:
+            self.prefetcher = Prefetcher(
+                depth=prefetch_depth, max_concurrency=prefetch_concurrency
+            )
         # self.environment = environment
 
-    async def _get_channel_by_context(
-        self, context: commands.Context, channel_name: commands.clean_content = None
-    ):
-        try:
-            # Determine whether to get channel by author or by channel_name arg(s)
-            if channel_name is None:
-                channel = context.author.voice.channel
-            else:
-                channels = context.guild.channels
-                channel = next(
-                    c
-                    for c in channels
-                    if c.name == channel_name and isinstance(c, discord.VoiceChannel)
+        self.outbox = Outbox()
+        self.channel_index = ChannelIndex()
+        # Report tasks still waiting on their resolution, the loop only
+        # keeps weak references to tasks
+        self._reports = set()
+
+        # Queues survive restarts when set
+        self.queue_store = None
+        if queue_db is not None:
+            self.queue_store = QueueStore(queue_db)
+        self._queue_flusher = None
+        self._restored = False
+
+        self.metrics_port = metrics_port
+        self._metrics_runner = None
+        metrics.gauge(
+            "active_guilds",
+            lambda: sum(player.is_playing for player in self.players.values()),
+        )
+        metrics.gauge(
+            "queue_depth",
+            lambda: sum(len(player.queue) for player in self.players.values()),
+        )
+        metrics.gauge("extract", lambda: get_scheduler().stats())
+        metrics.gauge("audio_cache", lambda: _stats(get_audio_cache()))
+        metrics.gauge("metadata_cache", lambda: _stats(get_metadata_cache()))
+        metrics.gauge("clip_memory", lambda: _stats(get_clip_store()))
+        metrics.gauge("loudness", lambda: _stats(get_loudness()))
+        metrics.gauge("queue_store", lambda: _stats(self.queue_store))
+
+    async def cog_load(self):
+        if self.metrics_port:
+            self._metrics_runner = await metrics.start_server(self.metrics_port)
+
+    async def cog_unload(self):
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+            self._metrics_runner = None
+
+        if self._queue_flusher is not None:
+            self._queue_flusher.cancel()
+            self._queue_flusher = None
+        if self.queue_store is not None:
+            await self.queue_store.flush(self.players)
+            self.queue_store.close()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # NOTE: on_ready fires again after reconnects
+        if self.queue_store is None or self._restored:
+            return
+        self._restored = True
+
+        await self._restore()
+        self._queue_flusher = asyncio.create_task(self.queue_store.run(self.players))
+
+    async def _restore(self):
+        """Queues again whatever was queued when the bot last went down"""
+        saved = await asyncio.to_thread(self.queue_store.load)
+        for guild_id, (elapsed, queue_items) in saved.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                # Left the guild or it's on another shard
+                continue
+
+            if queue_items:
+                # Picks up where the bot went down
+                queue_items[0].start_at = elapsed
+
+            player = self._get_player(guild)
+            for queue_item in queue_items:
+                await player.add(queue_item)
+            player.start()
+            print(
+                "restored {count} items in guild {guild_id}".format(
+                    count=len(queue_items), guild_id=guild_id
                 )
-
-            return channel
-        except StopIteration:
-            # StopIteration embed
-            embed = discord.Embed(title="Failed to add to queue")
-            embed.set_author(
-                name=context.author.display_name,
-                icon_url=context.author.display_avatar.url,
             )
-            embed.add_field(
-                name="Failure",
-                value="Failed to find voice channel named `{channel}`".format(
-                    channel=channel_name
-                ),
-            )
-            await context.send(embed=embed)
-            return None
-        except AttributeError:
-            # AttributeError embed
-            embed = discord.Embed(title="Failed to add to queue")
-            embed.set_author(
-                name=context.author.display_name,
-                icon_url=context.author.display_avatar.url,
-            )
-            embed.add_field(
-                name="Failure",
-                value="Either join a channel or specify one after the url",
-            )
-            await context.send(embed=embed)
-            return None
-        except Exception as ex:
-            print(type(ex))
-            print(ex.args)
-            print(ex)
-
-            # Exception embed
-            embed = discord.Embed(title="Failed to add to queue")
-            embed.set_author(
-                name=context.author.display_name,
-                icon_url=context.author.display_avatar.url,
-            )
-            embed.add_field(
-                name="Failure",
-                value="UNKNOWN ISSUE",
+
+    def _get_player(self, guild: discord.Guild) -> YoutubeDiscordPlayer:
+        # Add guild_id if it doesn't exist yet
+        if guild.id not in self.players:
+            self.players[guild.id] = YoutubeDiscordPlayer(
+                guild,
+                prefetcher=self.prefetcher,
+                idle_timeout=self.idle_timeout,
             )
-            await context.send(embed=embed)
-            return None
 
-    async def _get_channel_by_interaction(
-        self, interaction: discord.Interaction, channel_name: str = None
+        return self.players[guild.id]
+
+    async def _add_playlist(
+        self, guild: discord.Guild, url: str, channel_id: int, requester_id: int
+    ) -> int:
+        """Queues placeholders for every playlist entry as soon as they are listed
+
+        Entries get resolved by the prefetcher or right before they play.
+
+        Returns:
+            int: How many entries were queued
+        """
+        player = self._get_player(guild)
+        generation = player.generation
+        count = 0
+        try:
+            async for download_data in iter_playlist(url, player.tag):
+                if player.generation != generation:
+                    # Stopped while still listing
+                    break
+
+                await player.add(
+                    QueueItem.create(download_data, channel_id, requester_id)
+                )
+                player.start()
+                count += 1
+        except ExtractCancelled:
+            pass
+
+        return count
+
+    def _report_in_background(
+        self,
+        player: YoutubeDiscordPlayer,
+        queue_item: QueueItem,
+        resolving: asyncio.Task,
+        notice: Notice,
+    ):
+        report = asyncio.create_task(
+            self._report_resolution(player, queue_item, resolving, notice)
+        )
+        self._reports.add(report)
+        report.add_done_callback(self._reports.discard)
+
+    async def _report_resolution(
+        self,
+        player: YoutubeDiscordPlayer,
+        queue_item: QueueItem,
+        resolving: asyncio.Task,
+        notice: Notice,
     ):
+        """Edits the queue notice once the pending item resolved or the player
+        gave up on it
+        """
         try:
-            # Determine whether to get channel by author or by channel_name arg(s)
+            await resolving
+        except ExtractCancelled:
+            self.outbox.update(notice, failure="Stopped before it resolved")
+            return
+        except Exception as e:
+            print(e)
+            # Retried already, a playing item gets dropped by play_and_pop
+            player.remove(queue_item)
+            self.outbox.update(notice, failure="Couldn't resolve it")
+            return
+
+        if not queue_item.is_resolved:
+            # Stopped while waiting to retry
+            self.outbox.update(notice, failure="Stopped before it resolved")
+            return
+        self.outbox.update(notice, title=queue_item.title, url=queue_item.url)
+
+    def _get_channel(
+        self,
+        destination,
+        channel_id: int,
+        user: discord.Member,
+        channel_name: str = None,
+    ) -> discord.VoiceChannel:
+        """Finds the voice channel to play in, replying why when there is none
+
+        Args:
+            destination (discord.abc.Messageable | discord.Webhook):
+                Where the failure gets sent
+            channel_id (int): Channel the reply ends up in
+            user (discord.Member): Who asked, their voice channel is used
+                when channel_name isn't given
+            channel_name (str, optional): Name or start of the name of a
+                voice channel, ignoring case. Defaults to None.
+
+        Returns:
+            discord.VoiceChannel: The channel or None
+        """
+        # Determine whether to get channel by author or by channel_name arg(s)
+        with metrics.span("channel_lookup"):
             if channel_name is None:
-                channel = interaction.user.voice.channel
+                voice = user.voice
+                channel = None if voice is None else voice.channel
+                failure = "Either join a channel or specify one after the url"
             else:
-                channels = interaction.guild.channels
-                channel = next(
-                    c
-                    for c in channels
-                    if c.name == channel_name and isinstance(c, discord.VoiceChannel)
+                channel = self.channel_index.find(user.guild, channel_name)
+                failure = "Failed to find voice channel named `{channel}`".format(
+                    channel=channel_name
                 )
 
-            return channel
-        except StopIteration:
-            # StopIteration embed
-            embed = discord.Embed(title="Failed to add to queue")
-            embed.set_author(
-                name=interaction.user.display_name,
-                icon_url=interaction.user.display_avatar.url,
-            )
-            embed.add_field(
-                name="Failure",
-                value="Failed to find voice channel named `{channel}`".format(
-                    channel=channel_name
-                ),
-            )
-            await interaction.followup.send(embed=embed)
-            return None
-        except AttributeError:
-            # AttributeError embed
+        if channel is None:
             embed = discord.Embed(title="Failed to add to queue")
             embed.set_author(
-                name=interaction.user.display_name,
-                icon_url=interaction.user.display_avatar.url,
+                name=user.display_name,
+                icon_url=user.display_avatar.url,
             )
-            embed.add_field(
-                name="Failure",
-                value="Either join a channel or specify one after the url",
-            )
-            await interaction.followup.send(embed=embed)
-            return None
-        except Exception as ex:
-            print(type(ex))
-            print(ex.args)
-            print(ex)
-
-            # Exception embed
-            embed = discord.Embed(title="Failed to add to queue")
-            embed.set_author(
-                name=interaction.user.display_name,
-                icon_url=interaction.user.display_avatar.url,
-            )
-            embed.add_field(
-                name="Failure",
-                value="UNKNOWN ISSUE",
-            )
-            await interaction.followup.send(embed=embed)
-            return None
+            embed.add_field(name="Failure", value=failure)
+            self.outbox.send(destination, channel_id, embed=embed)
+        return channel
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        if isinstance(channel, discord.VoiceChannel):
+            self.channel_index.add(channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        if isinstance(channel, discord.VoiceChannel):
+            self.channel_index.remove(channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(
+        self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel
+    ):
+        if isinstance(before, discord.VoiceChannel):
+            self.channel_index.remove(before)
+        if isinstance(after, discord.VoiceChannel):
+            self.channel_index.add(after)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.channel_index.forget(guild)
 
     ### SYNC SECTION ###
 
@@ -282,6 +810,48 @@ class YoutubeCommands(commands.Cog):
             await self.bot.tree.sync()
             await ctx.reply(f"Un-Synced global !")
 
+    ### CACHE SECTION ###
+
+    @commands.command()
+    @commands.is_owner()
+    async def cachestats(self, ctx: commands.Context) -> None:
+        """Shows audio and metadata cache counters for sizing them"""
+        embeds = []
+        for title, cache in (
+            ("Audio Cache", get_audio_cache()),
+            ("Metadata Cache", get_metadata_cache()),
+            ("Clip Memory", get_clip_store()),
+            ("Loudness", get_loudness()),
+        ):
+            embed = discord.Embed(title=title)
+            if cache is None:
+                embed.add_field(name="Disabled", value="Not configured")
+            else:
+                for name, value in cache.stats().items():
+                    embed.add_field(name=name, value=str(value))
+            embeds.append(embed)
+        await ctx.reply(embeds=embeds)
+
+    @commands.command()
+    @commands.is_owner()
+    async def extractstats(self, ctx: commands.Context) -> None:
+        """Shows queue depth and wait time of the yt-dlp workers"""
+        embed = discord.Embed(title="Extraction")
+        for name, value in get_scheduler().stats().items():
+            if isinstance(value, float):
+                value = "{value:.3f}s".format(value=value)
+            embed.add_field(name=name, value=str(value))
+        await ctx.reply(embed=embed)
+
+    @commands.command(name="metrics")
+    @commands.is_owner()
+    async def metricsdump(self, ctx: commands.Context) -> None:
+        """Dumps stage latencies, counters and gauges as JSON"""
+        dump = json.dumps(metrics.snapshot(), indent=2)
+        await ctx.reply(
+            file=discord.File(io.BytesIO(dump.encode()), filename="metrics.json")
+        )
+
     ### PLAY SECTION ###
 
     @commands.command(
@@ -295,9 +865,9 @@ class YoutubeCommands(commands.Cog):
     ):
         """
         1. Determines channel to play audio in
-        2. Downloads sound from youtube video
-        3. Adds to player queue
-        4?. Starts player queue if its not playing
+        2. Adds to player queue right away
+        3?. Starts player queue if its not playing
+        4. Resolves/downloads in the background and edits the reply
 
         Args:
             context (_type_): Discord context
@@ -305,37 +875,25 @@ class YoutubeCommands(commands.Cog):
             channel_name (commands.clean_content, optional):
                 The name of the target channel to play audio in. Defaults to None.
         """
-        guild_id = context.author.guild.id
-
         # Get channel or return out
-        # NOTE: _get_channel sends back an embed based on exception
-        channel = await self._get_channel_by_context(context, channel_name)
+        # NOTE: _get_channel sends back an embed when there is none
+        channel = self._get_channel(
+            context, context.channel.id, context.author, channel_name
+        )
         if channel is None:
             return
 
-        download_data = await download(url, str(guild_id))
+        # Queued right away, resolves in the background
+        player = self._get_player(context.guild)
+        queue_item = QueueItem(url, channel.id, context.author.id)
+        resolving = await player.add(queue_item, resolve=True)
+        player.start()
 
-        # Create embed for adding to queue
-        embed = discord.Embed(title="Adding to queue")
-        embed.set_author(
-            name=context.author.display_name, icon_url=context.author.display_avatar.url
-        )
-        embed.add_field(name=download_data["title"], value=download_data["url"])
-        await context.send(embed=embed)
-
-        # Add guild_id if it doesn't exist yet
-        if guild_id not in self.players:
-            self.players[guild_id] = YoutubeDiscordPlayer()
-
-        self.players[guild_id].add(
-            url=download_data["url"],
-            channel=channel,
-            download_data=download_data,
-            context=context,
-            interaction=None,
+        # Bursts of these end up as one edited message
+        notice = self.outbox.add_to_queue(
+            context, context.channel.id, context.author, None, url
         )
-        if not self.players[guild_id].is_playing:
-            await self.players[guild_id].start()
+        self._report_in_background(player, queue_item, resolving, notice)
 
     @discord.app_commands.command(
         name="p",
@@ -347,9 +905,9 @@ class YoutubeCommands(commands.Cog):
     ):
         """
         1. Determines channel to play audio in
-        2. Downloads sound from youtube video
-        3. Adds to player queue
-        4?. Starts player queue if its not playing
+        2. Adds to player queue right away
+        3?. Starts player queue if its not playing
+        4. Resolves/downloads in the background and edits the reply
 
         Args:
             interaction (_type_): Discord interaction
@@ -359,38 +917,122 @@ class YoutubeCommands(commands.Cog):
         """
         await interaction.response.defer()
 
-        guild_id = interaction.guild.id
+        # Get channel or return out
+        # NOTE: _get_channel sends back an embed when there is none
+        channel = self._get_channel(
+            interaction.followup,
+            interaction.channel_id,
+            interaction.user,
+            channel_name,
+        )
+        if channel is None:
+            return
+
+        # Queued right away, resolves in the background
+        player = self._get_player(interaction.guild)
+        queue_item = QueueItem(url, channel.id, interaction.user.id)
+        resolving = await player.add(queue_item, resolve=True)
+        player.start()
+
+        # NOTE: the deferred interaction needs its own followup
+        notice = self.outbox.add_to_queue(
+            interaction.followup,
+            interaction.channel_id,
+            interaction.user,
+            None,
+            url,
+            join=False,
+        )
+        self._report_in_background(player, queue_item, resolving, notice)
+
+    @commands.command(
+        name="playlist",
+        description="Queue a whole Youtube playlist and optional target channel",
+        help="Queue a whole Youtube playlist and optional target channel",
+        usage="!steve playlist <url> <target_channel?>",
+    )
+    async def playlist(
+        self, context: commands.Context, url: str, *, channel_name: str = None
+    ):
+        """
+        1. Determines channel to play audio in
+        2. Lists the playlist's videos without resolving them
+        3. Adds them to player queue as they are listed
+        4?. Starts player queue if its not playing
+
+        Args:
+            context (_type_): Discord context
+            url (str): Url to youtube playlist
+            channel_name (commands.clean_content, optional):
+                The name of the target channel to play audio in. Defaults to None.
+        """
+        # Get channel or return out
+        # NOTE: _get_channel sends back an embed when there is none
+        channel = self._get_channel(
+            context, context.channel.id, context.author, channel_name
+        )
+        if channel is None:
+            return
+
+        count = await self._add_playlist(
+            context.guild, url, channel.id, context.author.id
+        )
+
+        # Create embed for adding to queue
+        embed = discord.Embed(title="Added playlist to queue")
+        embed.set_author(
+            name=context.author.display_name, icon_url=context.author.display_avatar.url
+        )
+        embed.add_field(name="{count} items".format(count=count), value=url)
+        self.outbox.send(context, context.channel.id, embed=embed)
+
+    @discord.app_commands.command(
+        name="pl",
+        description="Queue a whole Youtube playlist and optional target channel",
+    )
+    @discord.app_commands.describe(url="url", channel_name="channel name")
+    async def qplaylist(
+        self, interaction: discord.Interaction, url: str, channel_name: str = None
+    ):
+        """
+        1. Determines channel to play audio in
+        2. Lists the playlist's videos without resolving them
+        3. Adds them to player queue as they are listed
+        4?. Starts player queue if its not playing
+
+        Args:
+            interaction (_type_): Discord interaction
+            url (str): Url to youtube playlist
+            channel_name (commands.clean_content, optional):
+                The name of the target channel to play audio in. Defaults to None.
+        """
+        await interaction.response.defer()
 
         # Get channel or return out
-        # NOTE: _get_channel sends back an embed based on exception
-        channel = await self._get_channel_by_interaction(interaction, channel_name)
+        # NOTE: _get_channel sends back an embed when there is none
+        channel = self._get_channel(
+            interaction.followup,
+            interaction.channel_id,
+            interaction.user,
+            channel_name,
+        )
         if channel is None:
             return
 
-        download_data = await download(url, str(guild_id))
+        count = await self._add_playlist(
+            interaction.guild, url, channel.id, interaction.user.id
+        )
 
         # Create embed for adding to queue
-        embed = discord.Embed(title="Adding to queue")
+        embed = discord.Embed(title="Added playlist to queue")
         embed.set_author(
             name=interaction.user.display_name,
             icon_url=interaction.user.display_avatar.url,
         )
-        embed.add_field(name=download_data["title"], value=download_data["url"])
-        await interaction.followup.send(embed=embed)
-
-        # Add guild_id if it doesn't exist yet
-        if guild_id not in self.players:
-            self.players[guild_id] = YoutubeDiscordPlayer()
-
-        self.players[guild_id].add(
-            url=download_data["url"],
-            channel=channel,
-            download_data=download_data,
-            context=None,
-            interaction=interaction,
+        embed.add_field(name="{count} items".format(count=count), value=url)
+        self.outbox.send(
+            interaction.followup, interaction.channel_id, embed=embed
         )
-        if not self.players[guild_id].is_playing:
-            await self.players[guild_id].start()
 
     ### STOP SECTION ###
 
@@ -406,7 +1048,7 @@ class YoutubeCommands(commands.Cog):
         embed.set_author(
             name=context.author.display_name, icon_url=context.author.display_avatar.url
         )
-        await context.send(embed=embed)
+        self.outbox.send(context, context.channel.id, embed=embed)
 
         # Reset player
         guild_id = context.author.guild.id
@@ -429,7 +1071,9 @@ class YoutubeCommands(commands.Cog):
             name=interaction.user.display_name,
             icon_url=interaction.user.display_avatar.url,
         )
-        await interaction.followup.send(embed=embed)
+        self.outbox.send(
+            interaction.followup, interaction.channel_id, embed=embed
+        )
 
         # Reset player
         guild_id = interaction.user.guild.id
@@ -454,35 +1098,22 @@ class YoutubeCommands(commands.Cog):
                 name=context.author.display_name,
                 icon_url=context.author.display_avatar.url,
             )
-            await context.send(embed=embed)
+            self.outbox.send(context, context.channel.id, embed=embed)
             return
 
         # Get needed information
         current = self.players[guild_id].queue[0]
-        download_data = current["download_data"]
-        url = current["url"]
-        if current["context"] is None:
-            interaction = current["interaction"]
+        # NOTE: whoever skips stands in if the requester isn't cached
+        requester = context.guild.get_member(current.requester_id) or context.author
 
-            # Create embed
-            embed = discord.Embed(title="Skipping")
-            embed.set_author(
-                name=interaction.user.display_name,
-                icon_url=interaction.user.display_avatar.url,
-            )
-            embed.add_field(name=download_data["title"], value=url)
-            await context.send(embed=embed)
-        else:
-            item_context = current["context"]
-
-            # Create embed
-            embed = discord.Embed(title="Skipping")
-            embed.set_author(
-                name=item_context.author.display_name,
-                icon_url=item_context.author.display_avatar.url,
-            )
-            embed.add_field(name=download_data["title"], value=url)
-            await context.send(embed=embed)
+        # Create embed
+        embed = discord.Embed(title="Skipping")
+        embed.set_author(
+            name=requester.display_name,
+            icon_url=requester.display_avatar.url,
+        )
+        embed.add_field(name=current.title or "Resolving…", value=current.url)
+        self.outbox.send(context, context.channel.id, embed=embed)
 
         # Skip
         self.players[guild_id].skip()
@@ -504,38 +1135,96 @@ class YoutubeCommands(commands.Cog):
                 name=interaction.user.display_name,
                 icon_url=interaction.user.display_avatar.url,
             )
-            await interaction.followup.send(embed=embed)
+            self.outbox.send(
+                interaction.followup, interaction.channel_id, embed=embed
+            )
             return
 
         # Get needed information
         current = self.players[guild_id].queue[0]
-        download_data = current["download_data"]
-        url = current["url"]
-        if current["context"] is None:
-            item_iteration = current["interaction"]
+        # NOTE: whoever skips stands in if the requester isn't cached
+        requester = (
+            interaction.guild.get_member(current.requester_id) or interaction.user
+        )
 
-            # Create embed
-            embed = discord.Embed(title="Skipping")
-            embed.set_author(
-                name=item_iteration.user.display_name,
-                icon_url=item_iteration.user.display_avatar.url,
+        # Create embed
+        embed = discord.Embed(title="Skipping")
+        embed.set_author(
+            name=requester.display_name,
+            icon_url=requester.display_avatar.url,
+        )
+        embed.add_field(name=current.title or "Resolving…", value=current.url)
+        self.outbox.send(
+            interaction.followup, interaction.channel_id, embed=embed
+        )
+
+        # Skip
+        self.players[guild_id].skip()
+
+    ### SEEK SECTION ###
+
+    def _seek(self, guild_id: int, position: str, user: discord.abc.User):
+        """Seeks the guild's current track
+
+        Returns:
+            discord.Embed: What happened
+        """
+        player = self.players.get(guild_id)
+        try:
+            seconds = parse_position(position)
+        except ValueError:
+            embed = discord.Embed(title="Failed to seek")
+            embed.add_field(
+                name="Failure",
+                value="`{position}` isn't a position like `90` or `1:30`".format(
+                    position=position
+                ),
             )
-            embed.add_field(name=download_data["title"], value=url)
-            await interaction.followup.send(embed=embed)
         else:
-            context = current["context"]
+            if player is None or not player.seek(seconds):
+                embed = discord.Embed(title="Nothing playing")
+            else:
+                embed = discord.Embed(title="Seeking")
+                embed.add_field(
+                    name=player.current.title or "Resolving…",
+                    value="{url}\nfrom {position}".format(
+                        url=player.current.url, position=format_position(seconds)
+                    ),
+                )
 
-            # Create embed
-            embed = discord.Embed(title="Skipping")
-            embed.set_author(
-                name=context.author.display_name,
-                icon_url=context.author.display_avatar.url,
-            )
-            embed.add_field(name=download_data["title"], value=url)
-            await interaction.followup.send(embed=embed)
+        embed.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+        return embed
 
-        # Skip
-        self.players[guild_id].skip()
+    @commands.command(
+        name="seek",
+        help="Plays the current audio from a position like 90 or 1:30",
+        usage="!steve seek <position>",
+    )
+    async def seek(self, context: commands.Context, position: str):
+        """Plays the current audio again from position
+
+        Args:
+            context (_type_): Discord context
+            position (str): Seconds or m:ss into the track
+        """
+        embed = self._seek(context.guild.id, position, context.author)
+        self.outbox.send(context, context.channel.id, embed=embed)
+
+    @discord.app_commands.command(
+        name="se",
+        description="Plays the current audio from a position like 90 or 1:30",
+    )
+    @discord.app_commands.describe(position="position")
+    async def qseek(self, interaction: discord.Interaction, position: str):
+        """Plays the current audio again from position
+
+        Args:
+            interaction (_type_): Discord interaction
+            position (str): Seconds or m:ss into the track
+        """
+        await interaction.response.defer()
+        embed = self._seek(interaction.guild.id, position, interaction.user)
+        self.outbox.send(interaction.followup, interaction.channel_id, embed=embed)
 
     ### QUEUE SECTION ###
 
@@ -552,24 +1241,12 @@ class YoutubeCommands(commands.Cog):
             # Nothing in queue
             embed = discord.Embed(title="Queue")
             embed.add_field(name="Empty", value="No items in queue")
-            await context.send(embed=embed)
+            self.outbox.send(context, context.channel.id, embed=embed)
         else:
-            for index, item in enumerate(self.players[guild_id].queue):
-                # Create embed for each item in queue
-                embed = discord.Embed(title=f"Queue Item {index}")
-                embed.set_author(
-                    name=context.author.display_name,
-                    icon_url=context.author.display_avatar.url,
-                )
-                embed.add_field(
-                    name="Title", value=item["download_data"]["title"], inline=False
-                )
-                embed.add_field(name="Url", value=item["url"], inline=False)
-                embed.add_field(
-                    name="Voice Channel",
-                    value="`{channel}`".format(channel=item["channel"].name),
-                )
-                await context.send(embed=embed)
+            # One message, more pages are behind its buttons
+            self.outbox.send(
+                context, context.channel.id, **queue_message(self.players[guild_id])
+            )
 
     @discord.app_commands.command(name="q", description="Shows current youtube queue")
     async def qqueue(self, interaction: discord.Interaction):
@@ -585,28 +1262,16 @@ class YoutubeCommands(commands.Cog):
             # Nothing in queue
             embed = discord.Embed(title="Queue")
             embed.add_field(name="Empty", value="No items in queue")
-            await interaction.response.send_message(embed=embed)
+            self.outbox.send(
+                interaction.followup, interaction.channel_id, embed=embed
+            )
         else:
-            embeds = []
-            for index, item in enumerate(self.players[guild_id].queue):
-                # Create embed for each item in queue
-                embed = discord.Embed(title=f"Queue Item {index}")
-                embed.set_author(
-                    name=interaction.user.display_name,
-                    icon_url=interaction.user.display_avatar.url,
-                )
-                embed.add_field(
-                    name="Item {index}".format(index=index),
-                    value=item["download_data"]["title"],
-                    inline=False,
-                )
-                embed.add_field(name="Url", value=item["url"], inline=False)
-                embed.add_field(
-                    name="Voice Channel",
-                    value="`{channel}`".format(channel=item["channel"].name),
-                )
-                embeds.append(embed)
-            await interaction.followup.send(embeds=embeds)
+            # One message, more pages are behind its buttons
+            self.outbox.send(
+                interaction.followup,
+                interaction.channel_id,
+                **queue_message(self.players[guild_id]),
+            )
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -615,4 +1280,13 @@ async def setup(bot: commands.Bot) -> None:
     Args:
         bot (commands.Bot): _description_
     """
-    await bot.add_cog(YoutubeCommands(bot))
+    await bot.add_cog(
+        YoutubeCommands(
+            bot,
+            prefetch_depth=int(os.getenv("PREFETCH_DEPTH", "2")),
+            prefetch_concurrency=int(os.getenv("PREFETCH_CONCURRENCY", "4")),
+            idle_timeout=float(os.getenv("VOICE_IDLE_TIMEOUT", "60")),
+            metrics_port=int(os.getenv("METRICS_PORT", "0")),
+            queue_db=os.getenv("QUEUE_DB"),
+        )
+    )
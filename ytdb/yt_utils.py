@@ -3,7 +3,199 @@
 
 """
 import asyncio
-import yt_dlp as youtube_dl
+import os
+import re
+import tempfile
+import threading
+from . import metrics
+from .audio_cache import AudioCache
+from .clip_store import ClipStore
+from .extract_scheduler import ExtractCancelled, ExtractScheduler
+from .loudness import LoudnessAnalyzer
+from .metadata_cache import MetadataCache
+from .single_flight import single_flight
+from .ydl_pool import YoutubeDLPool
+
+# "stream" only resolves the direct audio url and lets FFmpeg read it,
+# "download" writes the whole file to disk before it gets queued
+AUDIO_MODES = ("stream", "download")
+_audio_mode = "stream"
+
+# Only used in "download" mode, None when disabled
+_audio_cache = None
+
+# Where uncached downloads go, one sub directory per tag (guild id)
+_tmp_dir = "audio_tmp"
+
+# Running downloads, concurrent requests for the same video share one
+_downloads = {}
+
+# Short clips are kept in memory instead of on disk, None when disabled
+_clip_store = None
+
+# Measures cached tracks so they play at the same loudness, None when disabled
+_loudness = None
+
+# Resolved extract_info metadata by normalized input, None when disabled
+_metadata_cache = MetadataCache()
+
+# Reused YoutubeDL instances, one set per extraction thread
+_ydl_pool = YoutubeDLPool()
+
+
+def _warm_thread():
+    """Builds an extraction thread's YoutubeDL instances when it starts"""
+    option_sets = [_ydl_opts(_outtmpl(False))]
+    if _audio_mode == "download":
+        option_sets.append(_ydl_opts(_outtmpl(True)))
+    try:
+        _ydl_pool.warm(*option_sets)
+    except Exception as e:
+        # A failing initializer breaks the whole pool, build them on demand instead
+        print(e)
+
+
+# All yt-dlp work runs here instead of the loop's default executor
+_scheduler = ExtractScheduler(initializer=_warm_thread)
+
+# Flat playlist entries are handed over this many at a time
+PLAYLIST_CHUNK = 25
+
+# Youtube video ids can be read off of most urls without asking yt-dlp
+VIDEO_ID_PATTERN = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)"
+    r"([0-9A-Za-z_-]{11})"
+)
+
+
+def configure(
+    audio_mode: str = None,
+    cache_dir: str = None,
+    cache_max_bytes: int = None,
+    metadata_ttl: float = None,
+    metadata_db: str = None,
+    extract_workers: int = None,
+    tmp_dir: str = None,
+    clip_max_bytes: int = None,
+    clip_memory_bytes: int = None,
+    loudness_target: float = None,
+):
+    """Configure how audio gets fetched for this deployment
+
+    Args:
+        audio_mode (str, optional): One of AUDIO_MODES. Defaults to None (unchanged).
+        cache_dir (str, optional): Directory of the audio cache. Defaults to None.
+        cache_max_bytes (int, optional):
+            Byte budget of the audio cache, 0 disables it. Defaults to None.
+        metadata_ttl (float, optional):
+            Seconds resolved metadata is reused, 0 disables it. Defaults to None.
+        metadata_db (str, optional):
+            SQLite file backing the metadata cache. Defaults to None (memory only).
+        extract_workers (int, optional):
+            Threads dedicated to yt-dlp work. Defaults to None (unchanged).
+        tmp_dir (str, optional):
+            Directory of uncached downloads. Defaults to None (unchanged).
+        clip_max_bytes (int, optional):
+            Downloads up to this size stay in memory, 0 disables it. Defaults to None.
+        clip_memory_bytes (int, optional):
+            Cap on clip bytes held in memory across guilds. Defaults to None.
+        loudness_target (float, optional): Integrated loudness (LUFS) cached
+            tracks get normalized to. Defaults to None (disabled).
+    """
+    global _audio_mode, _audio_cache, _metadata_cache, _scheduler, _tmp_dir
+    global _clip_store, _loudness
+
+    if audio_mode is not None:
+        if audio_mode not in AUDIO_MODES:
+            raise ValueError(
+                "Unknown audio mode `{mode}`, expected one of {modes}".format(
+                    mode=audio_mode, modes=AUDIO_MODES
+                )
+            )
+        _audio_mode = audio_mode
+
+    if cache_max_bytes == 0:
+        _audio_cache = None
+    elif cache_dir is not None or cache_max_bytes is not None:
+        _audio_cache = AudioCache(
+            directory=cache_dir or "audio_cache",
+            max_bytes=cache_max_bytes or 1 << 30,
+        )
+
+    if metadata_ttl == 0:
+        _metadata_cache = None
+    elif metadata_ttl is not None or metadata_db is not None:
+        _metadata_cache = MetadataCache(ttl=metadata_ttl or 3600, db_path=metadata_db)
+
+    if tmp_dir is not None:
+        _tmp_dir = tmp_dir
+
+    if clip_max_bytes == 0:
+        _clip_store = None
+    elif clip_max_bytes is not None or clip_memory_bytes is not None:
+        _clip_store = ClipStore(
+            clip_max_bytes=clip_max_bytes or 2 << 20,
+            max_bytes=clip_memory_bytes or 64 << 20,
+        )
+
+    if loudness_target is not None:
+        # Only cached tracks get measured
+        _loudness = None
+        if _audio_cache is not None:
+            _loudness = LoudnessAnalyzer(_audio_cache, target=loudness_target)
+
+    if extract_workers is not None:
+        _scheduler = ExtractScheduler(
+            max_workers=extract_workers, initializer=_warm_thread
+        )
+
+
+def get_metadata_cache() -> MetadataCache:
+    """Gets the configured metadata cache, None when it is disabled"""
+    return _metadata_cache
+
+
+def get_clip_store() -> ClipStore:
+    """Gets the configured clip store, None when it is disabled"""
+    return _clip_store
+
+
+def get_loudness() -> LoudnessAnalyzer:
+    """Gets the configured loudness analyzer, None when it is disabled"""
+    return _loudness
+
+
+def get_scheduler() -> ExtractScheduler:
+    """Gets the scheduler running all yt-dlp work"""
+    return _scheduler
+
+
+def warm_up():
+    """Starts the extraction threads so their YoutubeDL instances are built
+    before the first request comes in
+    """
+    _scheduler.warm()
+
+
+def get_audio_cache() -> AudioCache:
+    """Gets the configured audio cache, None when it is disabled"""
+    return _audio_cache
+
+
+def parse_video_id(url_or_string: str) -> str:
+    """Gets the youtube video id from a url without a yt-dlp round trip
+
+    Args:
+        url_or_string (str): The url of the youtube video or search???
+
+    Returns:
+        str: The video id or None when it can't be told from the string
+    """
+    match = VIDEO_ID_PATTERN.search(url_or_string)
+    if match is None:
+        return None
+    return match.group(1)
+
 
 # async def download_audio_from_url(url, output_path='.', audio_format='mp3'):
 #     """
@@ -40,16 +232,45 @@ import yt_dlp as youtube_dl
 #     except Exception as e:
 #         print(f"An error occurred: {e}")
 
-async def download(url_or_string: str, tag: str = "unknown") -> str:
-    """Download from url or search string????
+def normalize_key(url_or_string: str) -> str:
+    """Normalizes user input so equivalent urls and searches share a cache key
 
-    Arguments:
+    Args:
         url_or_string (str): The url of the youtube video or search???
+
+    Returns:
+        str: The cache key
     """
+    video_id = parse_video_id(url_or_string)
+    if video_id is not None:
+        return "id:{id}".format(id=video_id)
+
+    url_or_string = url_or_string.strip()
+    if url_or_string.startswith(("http://", "https://")):
+        return "url:{url}".format(url=url_or_string)
+    return "search:{search}".format(search=" ".join(url_or_string.lower().split()))
 
+
+def _metadata(data: dict) -> dict:
+    """Trims extract_info output down to what playback needs"""
+    return {
+        "id": data["id"],
+        "title": data["title"],
+        "webpage_url": data["webpage_url"],
+        # Direct url of the format picked by 'bestaudio/best'
+        "url": data.get("url"),
+        "ext": data.get("ext"),
+        "acodec": data.get("acodec"),
+        "duration": data.get("duration"),
+        "filesize": data.get("filesize") or data.get("filesize_approx"),
+    }
+
+
+def _ydl_opts(outtmpl: str) -> dict:
+    """YoutubeDL options, equal options share pooled instances"""
     # Setup options
     # youtube_dl.utils.bug_reports_message = lambda: ""
-    ydl_opts = {
+    return {
         'format': 'bestaudio/best',  # Select the best audio format
         # 'postprocessors': [{
         #     'key': 'FFmpegExtractAudio',
@@ -58,29 +279,340 @@ async def download(url_or_string: str, tag: str = "unknown") -> str:
         # }],
         'quiet': True,
         'cookiefile': 'cookies.txt',
-        'outtmpl': '%(title)s.%(ext)s',  # Output template
+        'outtmpl': outtmpl,  # Output template
         'noplaylist': True,  # Don't download entire playlists
     }
-    ytdl = youtube_dl.YoutubeDL(ydl_opts)
 
-    # Go and download based off of url_or_string in background
-    loop = asyncio.get_event_loop()
-    data = await loop.run_in_executor(
-        None, lambda: ytdl.extract_info(url_or_string, download=True)
+
+def _outtmpl(should_download: bool) -> str:
+    """Output template for the current configuration and calling thread
+
+    Downloads are staged in a directory only the calling extraction thread
+    writes to and moved to their final path once finished.
+    """
+    if not should_download:
+        return '%(title)s.%(ext)s'
+
+    if _audio_cache is not None:
+        staging_dir = _audio_cache.tmp_directory
+    else:
+        staging_dir = os.path.join(_tmp_dir, ".staging")
+    thread_dir = "{pid}-{thread}".format(
+        pid=os.getpid(), thread=threading.current_thread().name
     )
+    return os.path.join(staging_dir, thread_dir, '%(id)s.%(ext)s')
+
+
+def _extract(url_or_string: str, should_download: bool) -> tuple:
+    """Runs yt-dlp, blocking so it belongs in an executor
+
+    Returns:
+        tuple: extract_info data of the (first) video and its file name
+    """
+    ytdl = _ydl_pool.get(_ydl_opts(_outtmpl(should_download)))
+    with metrics.span("download" if should_download else "extract_info"):
+        data = ytdl.extract_info(url_or_string, download=should_download)
 
     if "entries" in data:
         # take first item from a playlist
         data = data["entries"][0]
 
+    return data, ytdl.prepare_filename(data)
+
+
+def _process(info: dict) -> tuple:
+    """Downloads what an extraction without download resolved, blocking
+
+    Returns:
+        tuple: extract_info data of the video and its file name
+    """
+    ytdl = _ydl_pool.get(_ydl_opts(_outtmpl(True)))
+    with metrics.span("download"):
+        data = ytdl.process_ie_result(info, download=True)
+
+    return data, ytdl.prepare_filename(data)
+
+
+def _extract_staged(url_or_string: str, info: dict = None) -> tuple:
+    """Downloads and claims the file, blocking so it belongs in an executor
+
+    The extraction thread's next download is staged to the same path, so the
+    file gets a name of its own before the thread takes another job.
+
+    Args:
+        url_or_string (str): The url of the youtube video or search???
+        info (dict, optional): extract_info data already resolved for it, only
+            the download is left then. Defaults to None.
+
+    Returns:
+        tuple: extract_info data of the (first) video and its claimed file name
+    """
+    if info is None:
+        data, filename = _extract(url_or_string, True)
+    else:
+        data, filename = _process(info)
+    _, ext = os.path.splitext(filename)
+    fd, staged = tempfile.mkstemp(
+        suffix=ext, dir=os.path.dirname(os.path.dirname(filename))
+    )
+    os.close(fd)
+    os.replace(filename, staged)
+    return data, staged
+
+
+async def resolve(url_or_string: str, tag: str = "unknown") -> dict:
+    """Resolves metadata of a url or search string without downloading
+
+    Concurrent and repeated calls for the same input are answered from the
+    metadata cache until the signed stream url is about to expire.
+
+    Arguments:
+        url_or_string (str): The url of the youtube video or search???
+        tag (str): Tag of who is resolving (guild id)
+    """
+
+    async def _resolve():
+        data, _ = await _scheduler.run(
+            tag, lambda: _extract(url_or_string, False)
+        )
+        return _metadata(data)
+
+    if _metadata_cache is None:
+        return await _resolve()
+
+    while True:
+        try:
+            return await _metadata_cache.get_or_resolve(
+                normalize_key(url_or_string), _resolve
+            )
+        except ExtractCancelled as e:
+            if e.tag == tag:
+                raise
+            # The guild leading the shared resolution got stopped, this one wasn't
+
+
+async def download(url_or_string: str, tag: str = "unknown", mode: str = None) -> dict:
+    """Download from url or search string????
+
+    In "stream" mode nothing is written to disk, the returned dict holds a
+    `stream_url` instead of a `file` for FFmpeg to read from directly.
+
+    Arguments:
+        url_or_string (str): The url of the youtube video or search???
+        tag (str): Tag of who is downloading (guild id)
+        mode (str, optional): Overrides the configured audio mode. Defaults to None.
+    """
+    mode = mode or _audio_mode
+    should_download = mode == "download"
+    cache = _audio_cache if should_download else None
+
+    # Searches only know their video id once resolved before
+    video_id = parse_video_id(url_or_string)
+    if video_id is None and _metadata_cache is not None:
+        metadata = _metadata_cache.get(normalize_key(url_or_string))
+        if metadata is not None:
+            video_id = metadata["id"]
+
+    # Skip yt-dlp completely when the file is already cached
+    if cache is not None and video_id is not None:
+        cached = cache.get(video_id)
+        if cached is not None:
+            if _loudness is not None:
+                _loudness.schedule(cached)
+            return cached
+
+    if not should_download:
+        metadata = await resolve(url_or_string, tag)
+        return {
+            "id": metadata["id"],
+            "title": metadata["title"],
+            "url": metadata["webpage_url"],
+            "stream_url": metadata["url"],
+            "acodec": metadata["acodec"],
+            "duration": metadata.get("duration"),
+        }
+
+    # Cached files are shared by everyone, uncached ones only within a tag
+    key = video_id or normalize_key(url_or_string)
+    if cache is None:
+        key = (tag, key)
+
+    while True:
+        leading = key not in _downloads
+        try:
+            download_data = await single_flight(
+                _downloads, key, lambda: _download(url_or_string, tag)
+            )
+        except ExtractCancelled as e:
+            if e.tag == tag:
+                raise
+            # Whoever was downloading got stopped, this request wasn't
+            continue
+
+        if leading:
+            return download_data
+        if "clip" in download_data:
+            _clip_store.hold(download_data["clip"])
+            return dict(download_data)
+        if download_data.get("cached"):
+            # Take our own pin on the shared file
+            return cache.get(download_data["id"]) or download_data
+        return dict(download_data)
+
+
+def _fetch_clip(url: str, limit: int) -> bytes:
+    """Reads a whole format url into memory, blocking
+
+    Returns:
+        bytes: The clip or None when it turned out bigger than limit
+    """
+    ytdl = _ydl_pool.get(_ydl_opts(_outtmpl(False)))
+    with metrics.span("download"), ytdl.urlopen(url) as response:
+        clip = response.read(limit + 1)
+
+    if len(clip) > limit:
+        return None
+    return clip
+
+
+async def _download_clip(url_or_string: str, tag: str) -> tuple:
+    """Downloads a short clip into memory
+
+    Returns:
+        tuple: Download data holding the `clip` or None when it doesn't fit,
+            and the extract_info data when it had to be resolved for this
+    """
+    info = None
+    metadata = None
+    if _metadata_cache is not None:
+        metadata = _metadata_cache.get(normalize_key(url_or_string))
+    if metadata is None:
+        # Kept so a clip that doesn't fit gets downloaded without extracting again
+        info, _ = await _scheduler.run(tag, lambda: _extract(url_or_string, False))
+        metadata = _metadata(info)
+        if _metadata_cache is not None:
+            _metadata_cache.set(normalize_key(url_or_string), metadata)
+
+    size = metadata["filesize"]
+    if size is None or not _clip_store.reserve(size):
+        return None, info
+
+    try:
+        clip = await _scheduler.run(
+            tag, lambda: _fetch_clip(metadata["url"], _clip_store.clip_max_bytes)
+        )
+    except Exception:
+        _clip_store.cancel(size)
+        raise
+    if clip is None:
+        _clip_store.cancel(size)
+        return None, info
+
+    _clip_store.hold(clip, reserved=size)
+    metrics.inc("bytes_downloaded", len(clip))
+    download_data = {
+        "id": metadata["id"],
+        "title": metadata["title"],
+        "url": metadata["webpage_url"],
+        "acodec": metadata["acodec"],
+        "duration": metadata.get("duration"),
+        "clip": clip,
+    }
+    return download_data, info
+
+
+async def _download(url_or_string: str, tag: str) -> dict:
+    """Downloads to the staging dir and moves the file to its final path"""
+    info = None
+    if _clip_store is not None:
+        download_data, info = await _download_clip(url_or_string, tag)
+        if download_data is not None:
+            return download_data
+
+    # Go and download based off of url_or_string in background
+    data, filename = await _scheduler.run(
+        tag, lambda: _extract_staged(url_or_string, info)
+    )
+    if _metadata_cache is not None:
+        _metadata_cache.set(normalize_key(url_or_string), _metadata(data))
+    metrics.inc("bytes_downloaded", os.path.getsize(filename))
+
     # Create file and return information
-    filename = ytdl.prepare_filename(data)
-    return {
+    download_data = {
         "id": data["id"],
         "file": filename,
         "title": data["title"],
         "url": data["webpage_url"],
+        "acodec": data.get("acodec"),
+        "duration": data.get("duration"),
     }
+    if _audio_cache is not None:
+        download_data = _audio_cache.put(filename, download_data)
+        if _loudness is not None:
+            _loudness.schedule(download_data)
+        return download_data
+
+    # Unique per tag and video so no other guild can touch it
+    _, ext = os.path.splitext(filename)
+    file = os.path.join(_tmp_dir, tag, "{id}{ext}".format(id=data["id"], ext=ext))
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    os.replace(filename, file)
+    download_data["file"] = file
+    return download_data
+
+
+def _placeholder(entry: dict) -> dict:
+    """Download data of a flat playlist entry, resolved right before it plays"""
+    return {
+        "id": entry["id"],
+        "title": entry.get("title") or entry["id"],
+        "url": entry.get("webpage_url") or entry.get("url"),
+    }
+
+
+async def iter_playlist(url: str, tag: str = "unknown"):
+    """Lists a playlist's entries without resolving any of them
+
+    Uses flat extraction and hands entries over in chunks as yt-dlp pages
+    through the playlist, so the first entries can be queued long before
+    the last ones are known.
+
+    Arguments:
+        url (str): The url of the youtube playlist
+        tag (str): Tag of who is listing (guild id)
+
+    Yields:
+        dict: Placeholder download data (`id`, `title` and `url`) per entry
+    """
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    ydl_opts = dict(
+        _ydl_opts(_outtmpl(False)), extract_flat="in_playlist", noplaylist=False
+    )
+
+    def _list():
+        ytdl = _ydl_pool.get(ydl_opts)
+        data = ytdl.extract_info(url, download=False, process=False)
+
+        chunk = []
+        for entry in data.get("entries") or [data]:
+            chunk.append(_placeholder(entry))
+            if len(chunk) == PLAYLIST_CHUNK:
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                chunk = []
+        if chunk:
+            loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+
+    # NOTE: chunks are put before the job finishes, so None always comes last
+    job = asyncio.ensure_future(_scheduler.run(tag, _list))
+    job.add_done_callback(lambda _: chunks.put_nowait(None))
+    try:
+        while (chunk := await chunks.get()) is not None:
+            for entry in chunk:
+                yield entry
+        await job
+    finally:
+        job.cancel()
 
 
 if __name__ == "__main__":